@@ -12,27 +12,91 @@ import os.path
 import logging
 import time
 import json
+import shutil
+import sys
+import threading
+from hashlib import sha256
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
-from appletree.helpers import processProjectDocumentsTree
+from appletree.config import config
+from appletree.helpers import processProjectDocumentsTree, genuid
+
+# stored as-is, compressing them again only costs time
+COMPRESSED_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.webp')
+COMPRESSED_MAGIC = (b'\x89PNG', b'\xff\xd8\xff', b'GIF8')
+
+
+def isCompressed(name, data):
+    if os.path.splitext(name)[1].lower() in COMPRESSED_EXTENSIONS:
+        return True
+    return isinstance(data, bytes) and data.startswith(COMPRESSED_MAGIC)
+
+
+class VerifyingReader(object):
+    """ File-like wrapper of archive member, read() raises IOError at the end of data not matching
+    sha256 hexdigest (None: not verified) """
+
+    def __init__(self, f, digest):
+        self.f = f
+        self.digest = digest
+        self.hash = sha256()
+
+    def read(self, size=-1):
+        data = self.f.read(size)
+        if data:
+            self.hash.update(data)
+        elif self.digest and self.hash.hexdigest() != self.digest:
+            raise IOError("checksum mismatch")
+        return data
 
 
 class AppleTreeArchive(object):
+    """ Projects archive (zip), its meta is kept in appletree.archive entry:
+        id, timestamp, projects: projectid -> name,
+        manifest: entry path -> sha256 of entries stored in this archive,
+        files: entry path -> [size, mtime, sha256] of all projects files at export time,
+        base: {id, filename} of base archive (differential archive: unchanged files are not stored, they are
+              taken from the chain of base archives, filename is relative to this archive folder) """
+
     def __init__(self, filename, password=None):
         self.filename = filename
         self.passwd = password
         self.log = logging.getLogger("at.archive")
         self.a = None
         self.mode = 0
-        self.meta = dict(projects={}, timestamp=time.time())
+        self.meta = dict(id=genuid(), projects={}, timestamp=time.time(), manifest={}, files={})
+        # opened base archives, nearest first
+        self.bases = []
+        # files of base archive, set by setBase()
+        self.basefiles = None
 
     def open(self):
         try:
             self.a = zipfile.ZipFile(self.filename, 'r', compression=zipfile.ZIP_STORED, allowZip64=True)
             self.mode = 0
             self.loadMeta()
+            self.openBases()
             return True
         except Exception as e:
             self.log.error("open(): %s: %s", e.__class__.__name__, e)
+            self.close()
+
+    def openBases(self):
+        seen = set([self.meta.get('id')])
+        arch = self
+        base = self.meta.get('base')
+        while base:
+            if base['id'] in seen:
+                raise ValueError("archive chain loop: " + base['id'])
+            seen.add(base['id'])
+            arch = AppleTreeArchive(os.path.join(os.path.dirname(arch.filename), base['filename']), self.passwd)
+            arch.a = zipfile.ZipFile(arch.filename, 'r', allowZip64=True)
+            self.bases.append(arch)
+            arch.loadMeta()
+            if arch.meta.get('id') != base['id']:
+                raise ValueError("base archive does not match: " + arch.filename)
+            base = arch.meta.get('base')
 
     def create(self):
         try:
@@ -46,12 +110,20 @@ class AppleTreeArchive(object):
         ret = True
         if self.mode == 1 and not self.saveMeta():
             ret = False
-        self.a.close()
+        if self.a:
+            self.a.close()
         self.a = None
+        for arch in self.bases:
+            arch.close()
+        self.bases = []
         return ret
 
     def loadMeta(self):
-        pass
+        meta = json.loads(self.a.read('appletree.archive').decode('utf-8'))
+        meta.setdefault('projects', {})
+        # archives without manifest are restored unverified, without files they can not be a base
+        meta.setdefault('manifest', {})
+        self.meta = meta
 
     def saveMeta(self):
         try:
@@ -62,12 +134,38 @@ class AppleTreeArchive(object):
         except Exception as e:
             self.log.error("saveMeta(): %s: %s", e.__class__.__name__, e)
 
+    def setBase(self, base):
+        """ makes this (created) archive differential to (opened) base archive """
+        if base.meta.get('files') is None or not base.meta.get('id'):
+            raise ValueError("base archive has no files index: " + base.filename)
+        filename = os.path.relpath(os.path.abspath(base.filename), os.path.dirname(os.path.abspath(self.filename)))
+        self.meta['base'] = dict(id=base.meta['id'], filename=filename)
+        self.basefiles = base.meta['files']
+
+    @staticmethod
+    def documentPath(projectid, docid=None, name=None):
+        # entry path of document file (folder path ending with / without name)
+        path = 'projects/' + projectid + '/documents/'
+        if docid:
+            path += docid + '/'
+        if name:
+            path += name
+        return path
+
     def putProject(self, projectid, name):
         self.meta['projects'][projectid] = name
 
-    def putDocumentFile(self, projectid, docid, name, body):
-        vpath = os.path.join('projects', projectid, 'documents', docid, name)
-        self.a.writestr(vpath, body)
+    def _writeEntry(self, vpath, data, digest=None, compress_type=None):
+        if not isinstance(data, bytes):
+            data = data.encode('utf-8')
+        digest = digest or sha256(data).hexdigest()
+        self.meta['manifest'][vpath] = digest
+        self.meta['files'][vpath] = [len(data), None, digest]
+        self.a.writestr(vpath, data, compress_type=compress_type)
+
+    def putDocumentFile(self, projectid, docid, name, body, digest=None):
+        vpath = self.documentPath(projectid, docid, name)
+        self._writeEntry(vpath, body, digest, zipfile.ZIP_STORED if isCompressed(name, body) else None)
 
     def putDocument(self, projectid, docid, docmeta, docbody):
         try:
@@ -79,7 +177,7 @@ class AppleTreeArchive(object):
 
     def putDocumentImage(self, projectid, docid, name, data):
         try:
-            subpath = os.path.join('resources', 'images', name)
+            subpath = '/'.join(('resources', 'images', name))
             self.putDocumentFile(projectid, docid, subpath, data)
             return True
         except Exception as e:
@@ -88,8 +186,269 @@ class AppleTreeArchive(object):
     def putDocumentTree(self, projectid, doctree):
         try:
             data = json.dumps(doctree)
-            vpath = os.path.join('projects', projectid, 'documents', 'applenote.doctree')
-            self.a.writestr(vpath, data)
+            vpath = self.documentPath(projectid, name='applenote.doctree')
+            self._writeEntry(vpath, data)
+            return True
+        except Exception as e:
+            self.log.error("putDocumentTree(): %s: %s", e.__class__.__name__, e)
+
+    @staticmethod
+    def _readDocument(doc, docid, meta, prefix, basefiles):
+        # worker thread: [(name, data, [size, mtime, sha256])] of document files, info None: missing,
+        # data None: file is in base archive already (same size and mtime, or same content)
+        stats = doc.statDocumentFiles(docid) or dict()
+        names = ['document.meta.atdoc', 'document.atdoc']
+        names.extend('resources/images/' + image for image in doc.getImages(docid))
+        ret = []
+        for name in names:
+            size, mtime = stats.get(name, (None, None))
+            prev = basefiles.get(prefix + name) if basefiles else None
+            if prev and mtime is not None and prev[0] == size and prev[1] == mtime:
+                ret.append((name, None, prev))
+                continue
+
+            if name == 'document.meta.atdoc':
+                data = json.dumps(meta)
+            elif name == 'document.atdoc':
+                data = doc.getDocumentBody(docid)
+            else:
+                data = doc.getImageRaw(docid, name.rsplit('/', 1)[-1])
+            if data is None:
+                ret.append((name, None, None))
+                continue
+            if not isinstance(data, bytes):
+                data = data.encode('utf-8')
+            info = [len(data) if size is None else size, mtime, sha256(data).hexdigest()]
+            if prev and prev[2] == info[2]:
+                data = None
+            ret.append((name, data, info))
+        return ret
+
+    def exportProject(self, project, doctree, metas, progress=None, cancelled=None):
+        """ writes project with its documents (doctree: DocTree, metas: docid -> meta). Documents are read on
+        a worker pool a few ahead of the writer and written in doctree order, after setBase() only files changed
+        since base archive are written. progress(percent) and cancelled() are called on the calling thread.
+        Returns True on success """
+        projectid = project.projectid
+        doc = project.doc
+        self.putProject(projectid, project.name)
+        if not self.putDocumentTree(projectid, doctree.toList()):
+            return False
+
+        count = len(doctree)
+        workers = config.backend_workers or 1
+        documents = iter(doctree.ids)
+        pending = deque()
+        done = 0
+        written = 0
+        percent = -1
+        pool = ThreadPoolExecutor(max_workers=workers)
+        try:
+            while True:
+                # bounded read-ahead: memory use does not depend on project size
+                while len(pending) < workers * 2:
+                    docid = next(documents, None)
+                    if docid is None:
+                        break
+                    pending.append(pool.submit(self._readDocument, doc, docid, metas.get(docid),
+                                               self.documentPath(projectid, docid), self.basefiles))
+                if not pending:
+                    break
+                if cancelled and cancelled():
+                    self.log.info("exportProject(): cancelled")
+                    return False
+
+                docid = doctree.ids[done]
+                for name, data, info in pending.popleft().result():
+                    if info is None:
+                        self.log.warn("exportProject(): missing %s of %s", name, docid)
+                        continue
+                    if data is not None:
+                        self.putDocumentFile(projectid, docid, name, data, info[2])
+                        written += 1
+                    self.meta['files'][self.documentPath(projectid, docid, name)] = info
+
+                done += 1
+                if progress and done * 100 // count != percent:
+                    percent = done * 100 // count
+                    progress(percent)
+            self.log.info("exportProject(): %s documents, %s files written", count, written)
             return True
         except Exception as e:
-            self.log.error("putDocumentTree(): %s: %s", e.__class__.__name__)
+            self.log.error("exportProject(): %s: %s", e.__class__.__name__, e)
+            return False
+        finally:
+            for future in pending:
+                future.cancel()
+            pool.shutdown(wait=True)
+
+    def entries(self, prefix):
+        """ (path, archive, ZipInfo, sha256) of files under prefix, taken from this archive or its bases """
+        files = self.meta.get('files')
+        if files is None:
+            # archive without files index is a full one
+            for info in self.a.infolist():
+                if info.filename.startswith(prefix) and not info.filename.endswith('/'):
+                    yield info.filename, self, info, self.meta['manifest'].get(info.filename)
+            return
+
+        for vpath, info in files.items():
+            if not vpath.startswith(prefix):
+                continue
+            digest = info[2]
+            for arch in [self] + self.bases:
+                if arch.meta['manifest'].get(vpath) == digest:
+                    yield vpath, arch, arch.a.getinfo(vpath), digest
+                    break
+            else:
+                raise IOError("file missing in archives chain: " + vpath)
+
+    @staticmethod
+    def _readEntry(a, info, digest):
+        # whole (small) entry, verified
+        reader = VerifyingReader(a.open(info), digest)
+        data = reader.read()
+        reader.read()
+        return data
+
+    def _importDocument(self, handles, opened, doc, docid, entries):
+        # worker thread, every worker reads through its own ZipFile handles
+        zips = getattr(handles, 'zips', None)
+        if zips is None:
+            zips = handles.zips = dict()
+
+        for vpath, arch, info, digest in entries:
+            a = zips.get(arch.filename)
+            if a is None:
+                a = zips[arch.filename] = zipfile.ZipFile(arch.filename, 'r', allowZip64=True)
+                opened.append(a)
+            name = vpath.split('/', 4)[4]
+            if name == 'document.meta.atdoc':
+                meta = json.loads(self._readEntry(a, info, digest).decode('utf-8'))
+                if meta and not doc.putDocumentMeta(docid, meta):
+                    raise IOError("could not write meta: " + docid)
+                continue
+            with a.open(info) as f:
+                if not doc.putDocumentStream(docid, name, VerifyingReader(f, digest)):
+                    raise IOError("could not write {0}: {1}".format(docid, name))
+
+    def importProject(self, projectid, doc, progress=None, cancelled=None):
+        """ restores archived project projectid into backend doc (of a new project). Entries are streamed from
+        the archive (and its bases) on a worker pool and verified against the manifest (archives without manifest
+        are restored unverified), the doctree is written last, archives without doctree get a flat tree of their
+        documents. progress(percent) and cancelled() are called on the calling thread. Returns True on success """
+        prefix = self.documentPath(projectid)
+        treepath = prefix + 'applenote.doctree'
+
+        # docid -> entries
+        documents = dict()
+        tree = None
+        try:
+            for entry in self.entries(prefix):
+                if entry[0] == treepath:
+                    tree = entry
+                    continue
+                parts = entry[0][len(prefix):].split('/')
+                if len(parts) < 2 or '..' in parts or '' in parts:
+                    self.log.warn("importProject(): entry skipped: %s", entry[0])
+                    continue
+                documents.setdefault(parts[0], []).append(entry)
+        except Exception as e:
+            self.log.error("importProject(): %s: %s", e.__class__.__name__, e)
+            return False
+
+        count = len(documents) or 1
+        workers = config.backend_workers or 1
+        handles = threading.local()
+        opened = []
+        items = iter(documents.items())
+        pending = deque()
+        done = 0
+        percent = -1
+        pool = ThreadPoolExecutor(max_workers=workers)
+        try:
+            while True:
+                while len(pending) < workers * 2:
+                    item = next(items, None)
+                    if item is None:
+                        break
+                    pending.append(pool.submit(self._importDocument, handles, opened, doc, item[0], item[1]))
+                if not pending:
+                    break
+                if cancelled and cancelled():
+                    self.log.info("importProject(): cancelled")
+                    return False
+
+                pending.popleft().result()
+                done += 1
+                if progress and done * 100 // count != percent:
+                    percent = done * 100 // count
+                    progress(percent)
+
+            if tree is not None:
+                vpath, arch, info, digest = tree
+                doctree = json.loads(self._readEntry(arch.a, info, digest).decode('utf-8'))
+            else:
+                # old archives have no doctree, documents are restored top level in archive order
+                self.log.warn("importProject(): no doctree of project: %s, flat tree of %s documents", projectid,
+                              len(documents))
+                doctree = [[docid, docid, []] for docid in documents]
+            if not doc.setDocumentsTree(doctree):
+                raise IOError("could not write doctree")
+            return True
+        except Exception as e:
+            self.log.error("importProject(): %s: %s", e.__class__.__name__, e)
+            return False
+        finally:
+            for future in pending:
+                future.cancel()
+            pool.shutdown(wait=True)
+            for a in opened:
+                a.close()
+
+    def merge(self, filename):
+        """ writes full archive filename with projects of this archive, files are taken from the chain
+        of base archives (and verified). Returns True on success """
+        out = AppleTreeArchive(filename, self.passwd)
+        if not out.create():
+            return False
+        try:
+            out.meta['projects'] = dict(self.meta['projects'])
+            files = self.meta.get('files')
+            for projectid in self.meta['projects']:
+                for vpath, arch, info, digest in self.entries(self.documentPath(projectid)):
+                    zinfo = zipfile.ZipInfo(vpath, date_time=info.date_time)
+                    zinfo.compress_type = info.compress_type
+                    zinfo.file_size = info.file_size
+                    with arch.a.open(info) as src, out.a.open(zinfo, 'w') as dst:
+                        reader = VerifyingReader(src, digest)
+                        shutil.copyfileobj(reader, dst, 1024*1024)
+                    digest = reader.hash.hexdigest()
+                    out.meta['manifest'][vpath] = digest
+                    out.meta['files'][vpath] = files[vpath] if files else [info.file_size, None, digest]
+            return out.close()
+        except Exception as e:
+            self.log.error("merge(): %s: %s", e.__class__.__name__, e)
+            out.close()
+            os.remove(filename)
+            return False
+
+
+def main(argv):
+    """ python -m appletree.archive merge <archive> <output>
+    restores differential archive (with its chain of base archives) to a single full archive """
+    if len(argv) != 3 or argv[0] != 'merge':
+        print(main.__doc__.strip())
+        return 2
+    logging.basicConfig(level=logging.INFO)
+    arch = AppleTreeArchive(argv[1])
+    if not arch.open():
+        return 1
+    try:
+        return 0 if arch.merge(argv[2]) else 1
+    finally:
+        arch.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -28,19 +28,83 @@ from __future__ import print_function
 import logging
 from hashlib import sha1
 import os
+import shutil
+import tempfile
+from appletree.config import config
 
 
 DOCUMENT_META_KEYS = ('type', 'tags' )
 
+# durability policies for atomicWrite()
+DURABILITY_NONE = 'none'  # rename only, no fsync
+DURABILITY_FILE = 'file'  # fsync file before rename
+DURABILITY_DIR = 'dir'  # fsync file before rename and folder after rename
+DURABILITY_POLICIES = (DURABILITY_NONE, DURABILITY_FILE, DURABILITY_DIR)
+
+# process umask, read once: os.umask() can only be read by setting it, that is racy with writer threads
+_UMASK = os.umask(0o022)
+os.umask(_UMASK)
+
 
 class BackendDocuments(object):
     name = "dummy"
     projectid = None
+    # changes on every setDocumentsTree(), None: unknown (doctree can not be cached)
+    treeserial = None
+    # decoded images cache (gui.imagecache.ImageCache) attached by GUI, None: images are decoded on request
+    imagecache = None
 
     def __init__(self, projectid):
         self.log = logging.getLogger("at.backend")
         self.projectid = projectid
 
+    def listDocuments(self):
+        # None means: not known without walking documents tree
+        return None
+
+    def countDocuments(self):
+        return None
+
+    def getDocumentMeta(self, docid):
+        return None
+
+    def getImage(self, docid, name):
+        return None
+
+    def requestImage(self, docid, name, tag):
+        # (image, pending), pending: image is decoded in background and delivered with
+        # imagecache.decoded signal (tag, QImage or None)
+        return self.getImage(docid, name), False
+
+    def prefetchImages(self, docid, names):
+        return None
+
+    def putImage(self, docid, name, image):
+        return None
+
+    def getImageSize(self, docid, localname):
+        return None
+
+    def copyImage(self, docid, name, srcbackend, srcdocid):
+        image = srcbackend.getImage(srcdocid, name)
+        if not image:
+            return None
+        return self.putImage(docid, name, image)
+
+    def statDocumentFiles(self, docid):
+        # name -> (size, mtime) of document files, None: not supported
+        return None
+
+    def putDocumentStream(self, docid, name, src):
+        # document file (document.atdoc, resources/images/...) from file-like src
+        return None
+
+    def getDocumentsMetaBulk(self, docids):
+        ret = dict()
+        for docid in docids:
+            ret[docid] = self.getDocumentMeta(docid)
+        return ret
+
 
 def resourceNameToLocal(name, ext=""):
     scheme = name.split("://")[0]
@@ -55,3 +119,64 @@ def resourceNameToLocal(name, ext=""):
 
 def resourceImageLocalUrl(projectid, docid, name):
     return '{0}/documents/{1}/resources/images/{2}'.format(projectid, docid, name)
+
+
+def fsyncDir(path):
+    # not supported on windows, rename is durable enough there
+    if os.name != 'posix':
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def fsyncFile(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _atomicReplace(path, write, durability):
+    if durability is None:
+        durability = config.durability or DURABILITY_FILE
+
+    folder = os.path.dirname(path) or "."
+    fd, tmppath = tempfile.mkstemp(prefix="." + os.path.basename(path) + ".", suffix=".tmp", dir=folder)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+            if durability != DURABILITY_NONE:
+                f.flush()
+                os.fsync(f.fileno())
+        # mkstemp() creates 0600 files, keep mode of replaced file (or default mode for new one)
+        try:
+            mode = os.stat(path).st_mode & 0o7777
+        except FileNotFoundError:
+            mode = 0o666 & ~_UMASK
+        os.chmod(tmppath, mode)
+        os.replace(tmppath, path)
+    except:
+        try:
+            os.unlink(tmppath)
+        except OSError:
+            pass
+        raise
+
+    if durability == DURABILITY_DIR:
+        fsyncDir(folder)
+
+
+def atomicWrite(path, data, durability=None):
+    """ Write data (bytes) to temp file in the same folder and rename it over path,
+    so readers see old or new content, never truncated one. """
+    _atomicReplace(path, lambda f: f.write(data), durability)
+
+
+def atomicWriteStream(path, src, durability=None, bufsize=1024*1024):
+    """ Like atomicWrite(), content is copied from file-like src in chunks. When src.read() raises,
+    path is left untouched. """
+    _atomicReplace(path, lambda f: shutil.copyfileobj(src, f, bufsize), durability)
@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+#
+#       Copyright 2017+ Jakub Kolasa <jkolczasty@gmail.com>
+#
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 3 of the License, or
+#       (at your option) any later version.
+#
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+#
+# __author__ = 'Jakub Kolasa <jkolczasty@gmail.com'>
+#
+
+# Doctree snapshot (applenote.doctree) + append-only journal of tree operations (applenote.doctree.journal).
+#
+# Journal is text, first line is a header: {"version": 1, "snapshot": "<sha1 of snapshot file>"}, every next
+# line is a JSON list of operations from one save:
+#   ["insert", docid, name, parent, after]
+#   ["move", docid, parent, after]
+#   ["rename", docid, name]
+#   ["remove", docid]                   (with whole subtree)
+# parent None: top level, after None: first child, otherwise docid of previous sibling.
+# Journal is ignored when its header does not match snapshot (compaction was interrupted after the new snapshot
+# was written) and a torn last line is dropped, so replay always ends on a state from some completed save.
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+import os
+import json
+import logging
+from codecs import encode
+from hashlib import sha1
+from appletree.config import config
+from appletree.helpers import walkDocumentsTree
+from .base import atomicWrite, DURABILITY_NONE, DURABILITY_FILE
+
+JOURNAL_VERSION = 1
+
+
+class DocTreeState(object):
+    """ Mutable doctree: name, parent and children (docids) per document, None is the top level """
+
+    def __init__(self, doctree=None):
+        self.names = dict()
+        self.parents = dict()
+        self.children = {None: []}
+        for docid, docname, parent, depth in walkDocumentsTree(doctree or ()):
+            self.names[docid] = docname
+            self.parents[docid] = parent
+            self.children[docid] = []
+            self.children[parent].append(docid)
+
+    def toList(self):
+        ret = []
+        stack = [(None, ret)]
+        while stack:
+            parent, items = stack.pop()
+            for docid in self.children[parent]:
+                children = []
+                items.append([docid, self.names[docid], children])
+                stack.append((docid, children))
+        return ret
+
+    def _place(self, docid, parent, after):
+        siblings = self.children[parent]
+        siblings.insert(siblings.index(after) + 1 if after is not None else 0, docid)
+        self.parents[docid] = parent
+
+    def _remove(self, docid):
+        self.children[self.parents[docid]].remove(docid)
+        removed = []
+        stack = [docid]
+        while stack:
+            docid = stack.pop()
+            removed.append(docid)
+            stack.extend(self.children.pop(docid))
+            del self.names[docid]
+            del self.parents[docid]
+        return removed
+
+    def apply(self, op):
+        # raises on operation not matching the state (KeyError, ValueError)
+        action = op[0]
+        if action == "insert":
+            docid, name, parent, after = op[1:5]
+            if docid in self.names or parent not in self.children:
+                raise ValueError("insert: " + docid)
+            self.names[docid] = name
+            self.children[docid] = []
+            self._place(docid, parent, after)
+        elif action == "move":
+            docid, parent, after = op[1:4]
+            self.children[self.parents[docid]].remove(docid)
+            self._place(docid, parent, after)
+        elif action == "rename":
+            if op[1] not in self.names:
+                raise KeyError(op[1])
+            self.names[op[1]] = op[2]
+        elif action == "remove":
+            self._remove(op[1])
+        else:
+            raise ValueError("unknown operation: " + str(action))
+
+    def update(self, doctree):
+        """ change state to doctree, returns (operations, removed docids) """
+        ops = []
+        seen = set()
+        # parent -> count of children already in place
+        done = dict()
+        for docid, name, parent, depth in walkDocumentsTree(doctree):
+            seen.add(docid)
+            index = done.get(parent, 0)
+            done[parent] = index + 1
+            siblings = self.children[parent]
+            after = siblings[index - 1] if index else None
+
+            if docid not in self.names:
+                ops.append(["insert", docid, name, parent, after])
+                self.names[docid] = name
+                self.parents[docid] = parent
+                self.children[docid] = []
+                siblings.insert(index, docid)
+                continue
+
+            if index >= len(siblings) or siblings[index] != docid:
+                # siblings before index are in place already (docid is not one of them)
+                ops.append(["move", docid, parent, after])
+                self.children[self.parents[docid]].remove(docid)
+                siblings.insert(index, docid)
+                self.parents[docid] = parent
+
+            if self.names[docid] != name:
+                ops.append(["rename", docid, name])
+                self.names[docid] = name
+
+        removed = []
+        for docid in [docid for docid in self.names if docid not in seen]:
+            # subtrees go with their top removed document
+            if docid in self.names and (self.parents[docid] is None or self.parents[docid] in seen):
+                ops.append(["remove", docid])
+                removed.extend(self._remove(docid))
+        return ops, removed
+
+
+class DocTreeJournal(object):
+    def __init__(self, path):
+        self.log = logging.getLogger("at.backend.journal")
+        self.path = path
+        self.journalpath = path + ".journal"
+        self.state = None
+        self.snapshot = None
+        self.ops = 0
+        self.size = 0
+
+    def _header(self):
+        return encode(json.dumps(dict(version=JOURNAL_VERSION, snapshot=self.snapshot)) + "\n", "utf-8")
+
+    def load(self):
+        """ snapshot with journal replayed, None if there is no snapshot """
+        try:
+            with open(self.path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            self.state = DocTreeState()
+            self.snapshot = None
+            return None
+        state = DocTreeState(json.loads(data.decode("utf-8")))
+        self.state = state
+        self.snapshot = sha1(data).hexdigest()
+        self.ops = 0
+        self.size = 0
+
+        try:
+            with open(self.journalpath, "rb") as f:
+                lines = f.read().split(b"\n")
+        except FileNotFoundError:
+            return state.toList()
+
+        try:
+            header = json.loads(lines[0].decode("utf-8"))
+        except ValueError:
+            header = None
+        if not header or header.get('version') != JOURNAL_VERSION or header.get('snapshot') != self.snapshot:
+            self.log.warn("load(): stale journal ignored: %s", self.journalpath)
+            self.size = 0
+            return state.toList()
+
+        self.size = len(lines[0]) + 1
+        broken = False
+        for line in lines[1:]:
+            if not line:
+                continue
+            try:
+                ops = json.loads(line.decode("utf-8"))
+            except ValueError:
+                # torn write of the last save
+                self.log.warn("load(): incomplete journal entry dropped")
+                broken = True
+                break
+            try:
+                for op in ops:
+                    state.apply(op)
+            except Exception as e:
+                # state may have part of this entry applied, it is written as the new snapshot below
+                self.log.error("load(): journal replay failed: %s: %s", e.__class__.__name__, e)
+                broken = True
+                break
+            self.ops += len(ops)
+            self.size += len(line) + 1
+
+        self.log.info("load(): replayed %s operations", self.ops)
+        if broken:
+            # appends must not follow a bad entry
+            self.compact()
+        return state.toList()
+
+    def save(self, doctree):
+        """ returns (operations, removed docids), operations are already durable """
+        if self.state is None:
+            self.load()
+
+        ops, removed = self.state.update(doctree)
+        if self.snapshot is None:
+            self.compact()
+            return ops, removed
+        if not ops:
+            return ops, removed
+
+        line = encode(json.dumps(ops) + "\n", "utf-8")
+        if self.ops + len(ops) > config.doctree_journal_ops or self.size + len(line) > config.doctree_journal_size:
+            self.compact()
+            return ops, removed
+
+        if not self.size or not os.path.exists(self.journalpath):
+            atomicWrite(self.journalpath, self._header())
+            self.size = len(self._header())
+        with open(self.journalpath, "ab") as f:
+            f.write(line)
+            if (config.durability or DURABILITY_FILE) != DURABILITY_NONE:
+                f.flush()
+                os.fsync(f.fileno())
+        self.ops += len(ops)
+        self.size += len(line)
+        return ops, removed
+
+    def compact(self):
+        data = encode(json.dumps(self.state.toList()), "utf-8")
+        # new snapshot first: if journal reset does not happen, its header does not match anymore
+        atomicWrite(self.path, data)
+        self.snapshot = sha1(data).hexdigest()
+        atomicWrite(self.journalpath, self._header())
+        self.log.info("compact(): %s operations merged into snapshot", self.ops)
+        self.ops = 0
+        self.size = len(self._header())
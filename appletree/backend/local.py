@@ -20,17 +20,214 @@
 # __author__ = 'Jakub Kolasa <jkolczasty@gmail.com'>
 #
 
-from .base import BackendDocuments, resourceNameToLocal, DOCUMENT_META_KEYS
+from .journal import DocTreeJournal
+from .base import BackendDocuments, resourceNameToLocal, atomicWrite, atomicWriteStream, fsyncFile, \
+    DOCUMENT_META_KEYS, DURABILITY_NONE
 import os.path
 from codecs import encode, decode
-import json
+from io import StringIO
+from hashlib import sha1
 from appletree.config import config
 from appletree.gui.qt import Qt
 import shutil
 from configparser import ConfigParser
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+import logging
+import sqlite3
+import tempfile
 import traceback
 
 
+CATALOG_SCHEMA_VERSION = 2
+
+
+class DocumentsCatalog(object):
+    """ Project-wide documents metadata catalog (sqlite), kept next to applenote.doctree.
+    It is a cache only: document files stay authoritative and missing rows are filled lazily. """
+
+    def __init__(self, path):
+        self.log = logging.getLogger("at.backend.catalog")
+        self.path = path
+        self.lock = Lock()
+        self.db = None
+
+    def open(self):
+        try:
+            db = sqlite3.connect(self.path, check_same_thread=False)
+            version = db.execute("PRAGMA user_version").fetchone()[0]
+            if version != CATALOG_SCHEMA_VERSION:
+                db.execute("DROP TABLE IF EXISTS documents")
+                db.execute("DROP TABLE IF EXISTS images")
+                db.execute("DROP TABLE IF EXISTS state")
+            db.execute("CREATE TABLE IF NOT EXISTS documents (docid TEXT PRIMARY KEY, type TEXT, tags TEXT, "
+                       "name TEXT, parent TEXT, intree INTEGER NOT NULL DEFAULT 0, "
+                       "hasmeta INTEGER NOT NULL DEFAULT 0, mtime REAL, bodysize INTEGER)")
+            db.execute("CREATE TABLE IF NOT EXISTS images (docid TEXT NOT NULL, name TEXT NOT NULL, "
+                       "hash TEXT NOT NULL, PRIMARY KEY (docid, name))")
+            # blob reference counts
+            db.execute("CREATE INDEX IF NOT EXISTS images_hash ON images (hash)")
+            db.execute("CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT)")
+            db.execute("PRAGMA user_version = {0}".format(CATALOG_SCHEMA_VERSION))
+            db.commit()
+            self.db = db
+            return True
+        except Exception as e:
+            self.log.error("open(): %s: %s: %s", self.path, e.__class__.__name__, e)
+            return None
+
+    def close(self):
+        with self.lock:
+            if self.db:
+                self.db.close()
+                self.db = None
+
+    def _execute(self, method, sql, args=()):
+        with self.lock:
+            if not self.db:
+                return None
+            try:
+                cur = getattr(self.db, method)(sql, args)
+                rows = cur.fetchall()
+                self.db.commit()
+                return rows
+            except Exception as e:
+                self.log.error("%s: %s: %s", sql.split(" ", 1)[0], e.__class__.__name__, e)
+                return None
+
+    def getMeta(self, docids):
+        ret = dict()
+        docids = list(docids)
+        # keep below sqlite host parameters limit
+        for i in range(0, len(docids), 500):
+            chunk = docids[i:i + 500]
+            rows = self._execute("execute", "SELECT docid, type, tags FROM documents WHERE hasmeta = 1 AND "
+                                            "docid IN ({0})".format(",".join("?" * len(chunk))), chunk)
+            for docid, _type, tags in rows or ():
+                ret[docid] = dict(type=_type, tags=tags)
+        return ret
+
+    def putMeta(self, metas):
+        rows = [(docid, meta.get('type'), meta.get('tags')) for docid, meta in metas.items() if meta is not None]
+        self._execute("executemany", "INSERT INTO documents (docid, type, tags, hasmeta) VALUES (?, ?, ?, 1) "
+                                     "ON CONFLICT(docid) DO UPDATE SET type = excluded.type, "
+                                     "tags = excluded.tags, hasmeta = 1", rows)
+
+    def putBody(self, docid, size, mtime):
+        self._execute("execute", "INSERT INTO documents (docid, bodysize, mtime) VALUES (?, ?, ?) "
+                                 "ON CONFLICT(docid) DO UPDATE SET bodysize = excluded.bodysize, "
+                                 "mtime = excluded.mtime", (docid, size, mtime))
+
+    def remove(self, docid):
+        self._execute("execute", "DELETE FROM documents WHERE docid = ?", (docid,))
+
+    def getImage(self, docid, name):
+        rows = self._execute("execute", "SELECT hash FROM images WHERE docid = ? AND name = ?", (docid, name))
+        return rows[0][0] if rows else None
+
+    def _popImages(self, query, sql, args):
+        # query and change under one lock, returns hashes selected by query (with docid[, name] of args)
+        with self.lock:
+            if not self.db:
+                return None
+            try:
+                prev = [row[0] for row in self.db.execute(query, args[:2]).fetchall()]
+                self.db.execute(sql, args)
+                self.db.commit()
+                return prev
+            except Exception as e:
+                self.db.rollback()
+                self.log.error("%s: %s: %s", sql.split(" ", 1)[0], e.__class__.__name__, e)
+                return None
+
+    def setImage(self, docid, name, digest):
+        """ references blob digest from docid image name, returns previously referenced digest """
+        prev = self._popImages("SELECT hash FROM images WHERE docid = ? AND name = ?",
+                               "INSERT OR REPLACE INTO images (docid, name, hash) VALUES (?, ?, ?)",
+                               (docid, name, digest))
+        return prev[0] if prev else None
+
+    def popImage(self, docid, name):
+        prev = self._popImages("SELECT hash FROM images WHERE docid = ? AND name = ?",
+                               "DELETE FROM images WHERE docid = ? AND name = ?", (docid, name))
+        return prev[0] if prev else None
+
+    def popImages(self, docid):
+        return self._popImages("SELECT DISTINCT hash FROM images WHERE docid = ?",
+                               "DELETE FROM images WHERE docid = ?", (docid,)) or []
+
+    def releaseImage(self, digest, drop):
+        """ calls drop(digest) when blob is not referenced anymore, under lock: no reference can be taken
+        with setImage() meanwhile """
+        with self.lock:
+            if not self.db:
+                return False
+            try:
+                if self.db.execute("SELECT COUNT(*) FROM images WHERE hash = ?", (digest,)).fetchone()[0]:
+                    return False
+            except Exception as e:
+                self.log.error("releaseImage(): %s: %s", e.__class__.__name__, e)
+                return False
+            drop(digest)
+            return True
+
+    def setTree(self, tree, version='1'):
+        rows = []
+        stack = [(tree, None)]
+        while stack:
+            items, parent = stack.pop()
+            for docid, docname, children in items:
+                rows.append((docid, docname, parent))
+                if children:
+                    stack.append((children, docid))
+        return self.updateTree(rows, None, version)
+
+    def updateTree(self, rows, removed, version='1'):
+        """ rows: [(docid, name, parent), ...] in tree, removed: docids out of tree, None: all other """
+        with self.lock:
+            if not self.db:
+                return None
+            try:
+                if removed is None:
+                    self.db.execute("UPDATE documents SET intree = 0")
+                else:
+                    self.db.executemany("UPDATE documents SET intree = 0 WHERE docid = ?",
+                                        [(docid,) for docid in removed])
+                self.db.executemany("INSERT INTO documents (docid, name, parent, intree) VALUES (?, ?, ?, 1) "
+                                    "ON CONFLICT(docid) DO UPDATE SET name = excluded.name, "
+                                    "parent = excluded.parent, intree = 1", rows)
+                self.db.execute("INSERT OR REPLACE INTO state (key, value) VALUES ('tree', ?)", (version,))
+                self.db.commit()
+                return True
+            except Exception as e:
+                self.db.rollback()
+                self.log.error("updateTree(): %s: %s", e.__class__.__name__, e)
+                return None
+
+    def hasTree(self):
+        return self.treeVersion() is not None
+
+    def treeVersion(self):
+        rows = self._execute("execute", "SELECT value FROM state WHERE key = 'tree'")
+        return rows[0][0] if rows else None
+
+    def listDocuments(self):
+        if not self.hasTree():
+            return None
+        rows = self._execute("execute", "SELECT docid FROM documents WHERE intree = 1")
+        if rows is None:
+            return None
+        return [row[0] for row in rows]
+
+    def countDocuments(self):
+        if not self.hasTree():
+            return None
+        rows = self._execute("execute", "SELECT COUNT(*) FROM documents WHERE intree = 1")
+        if not rows:
+            return None
+        return rows[0][0]
+
+
 class BackendDocumentsLocal(BackendDocuments):
     name = "local"
     docdir = None
@@ -40,32 +237,95 @@ class BackendDocumentsLocal(BackendDocuments):
         # TODO: allow to switch between workspaces? Nah.
         self.workdir = os.path.join(config.data_dir)
         self.docdir = os.path.join(self.workdir, "projects", projectid, "documents")
+        # content addressed images store, documents images are hardlinks to its blobs
+        self.imagesdir = os.path.join(self.workdir, "projects", projectid, "images")
+
+        self.catalog = DocumentsCatalog(os.path.join(self.docdir, "applenote.catalog"))
+        if not self.catalog.open():
+            self.catalog = None
+        self.treeserial = 0
+        self.journal = DocTreeJournal(os.path.join(self.docdir, "applenote.doctree"))
+
+    def _journalVersion(self):
+        return "{0}:{1}".format(self.journal.snapshot, self.journal.ops)
 
     def getDocumentsTree(self):
-        path = os.path.join(self.docdir, "applenote.doctree")
         try:
-            with open(path, "r") as f:
-                data = json.loads(f.read())
+            data = self.journal.load()
+            if data is None:
+                raise FileNotFoundError(self.journal.path)
+            # catalog may miss the last journal entry after crash
+            if self.catalog and self.catalog.treeVersion() != self._journalVersion():
+                self.catalog.setTree(data, self._journalVersion())
             return data
         except Exception as e:
             self.log.error("getDocumentsTree(): Failed to read meta file: %s: %s", e.__class__.__name__, e)
             return None
 
     def setDocumentsTree(self, tree):
-        path = os.path.join(self.docdir, "applenote.doctree")
         try:
-            with open(path, "w") as f:
-                f.write(json.dumps(tree))
+            ops, removed = self.journal.save(tree)
+            self.treeserial += 1
+            if self.catalog:
+                state = self.journal.state
+                rows = [(op[1], state.names[op[1]], state.parents[op[1]]) for op in ops
+                        if op[0] != "remove" and op[1] in state.names]
+                self.catalog.updateTree(rows, removed, self._journalVersion())
             return True
         except Exception as e:
-            self.log.error("setDocumentsTree(): Failed to read meta file: %s: %s", e.__class__.__name__, e)
+            self.log.error("setDocumentsTree(): Failed to write doctree: %s: %s", e.__class__.__name__, e)
+            # reread snapshot and journal on next save
+            self.journal.state = None
+            return None
+
+    def listDocuments(self):
+        if not self.catalog:
+            return None
+        return self.catalog.listDocuments()
+
+    def countDocuments(self):
+        if not self.catalog:
             return None
+        return self.catalog.countDocuments()
 
     def getDocumentMeta(self, docid):
+        self.log.info("getDocumentMeta(): %s", docid)
+        if self.catalog:
+            meta = self.catalog.getMeta((docid,)).get(docid)
+            if meta is not None:
+                return meta
+
+        meta = self._readDocumentMeta(docid)
+        if self.catalog and meta:
+            self.catalog.putMeta({docid: meta})
+        return meta
+
+    def getDocumentsMetaBulk(self, docids):
+        docids = list(docids)
+        self.log.info("getDocumentsMetaBulk(): %s documents", len(docids))
+        ret = self.catalog.getMeta(docids) if self.catalog else dict()
+        missing = [docid for docid in docids if docid not in ret]
+        if not missing:
+            return ret
+
+        self.log.info("getDocumentsMetaBulk(): %s documents not in catalog", len(missing))
+        if len(missing) < 2:
+            metas = [self._readDocumentMeta(docid) for docid in missing]
+        else:
+            workers = min(config.backend_workers or 1, len(missing))
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                metas = list(pool.map(self._readDocumentMeta, missing))
+
+        metas = dict(zip(missing, metas))
+        if self.catalog:
+            self.catalog.putMeta(dict((docid, meta) for docid, meta in metas.items() if meta))
+        ret.update(metas)
+        return ret
+
+    def _readDocumentMeta(self, docid):
         path = os.path.join(self.docdir, docid)
 
         fn = os.path.join(path, "document.meta.atdoc")
-        self.log.info("getDocumentMeta(): %s: %s", docid, fn)
         meta = {}
         try:
             cfg = ConfigParser()
@@ -102,8 +362,11 @@ class BackendDocumentsLocal(BackendDocuments):
                     continue
 
                 cfg.set(section, k, str(v))
-            with open(fn, 'w') as f:
-                cfg.write(f)
+            data = StringIO()
+            cfg.write(data)
+            atomicWrite(fn, encode(data.getvalue(), "utf-8"))
+            if self.catalog:
+                self.catalog.putMeta({docid: dict((k, meta.get(k)) for k in DOCUMENT_META_KEYS)})
             return True
         except Exception as e:
             self.log.error("putDocumentMeta(): exception: %s: %s: %s", fn, e.__class__.__name__, e)
@@ -115,7 +378,7 @@ class BackendDocumentsLocal(BackendDocuments):
             _meta = {}
 
         _meta.update(meta)
-        return self.putDocumentMeta(docid, meta)
+        return self.putDocumentMeta(docid, _meta)
 
     def getDocumentBody(self, docid):
         path = os.path.join(self.docdir, docid)
@@ -171,12 +434,38 @@ class BackendDocumentsLocal(BackendDocuments):
     def getImages(self, docid):
         path = os.path.join(self.docdir, docid, "resources", "images")
         ret = []
-        # TODO: try...catch
-        for fn in os.listdir(path):
+        try:
+            names = os.listdir(path)
+        except FileNotFoundError:
+            # document without images folder
+            return ret
+        for fn in names:
+            if fn.startswith("."):
+                continue
             ret.append(fn)
 
         return ret
 
+    def statDocumentFiles(self, docid):
+        path = os.path.join(self.docdir, docid)
+        ret = dict()
+        for name in ('document.meta.atdoc', 'document.atdoc'):
+            try:
+                st = os.stat(os.path.join(path, name))
+                ret[name] = (st.st_size, st.st_mtime_ns)
+            except FileNotFoundError:
+                pass
+        try:
+            with os.scandir(os.path.join(path, "resources", "images")) as it:
+                for entry in it:
+                    if entry.name.startswith("."):
+                        continue
+                    st = entry.stat()
+                    ret['resources/images/' + entry.name] = (st.st_size, st.st_mtime_ns)
+        except FileNotFoundError:
+            pass
+        return ret
+
     def _createDocumentFolder(self, path):
         try:
             os.mkdir(os.path.join(path))
@@ -197,8 +486,11 @@ class BackendDocumentsLocal(BackendDocuments):
 
         self.log.info("putDocumentBody(): %s: %s", docid, fn)
         try:
-            with open(fn, 'wb') as f:
-                f.write(encode(body, "utf-8"))
+            data = encode(body, "utf-8")
+            atomicWrite(fn, data)
+            if self.catalog:
+                # file mtime, comparable with os.stat() of the body later
+                self.catalog.putBody(docid, len(data), os.stat(fn).st_mtime)
 
             if dropdraft:
                 self.dropDocumentBodyDraft(docid)
@@ -206,14 +498,37 @@ class BackendDocumentsLocal(BackendDocuments):
         except Exception as e:
             self.log.error("putDocumentBody(): exception: %s: %s: %s", fn, e.__class__.__name__, e)
 
+    def putDocumentStream(self, docid, name, src):
+        path = os.path.join(self.docdir, docid)
+
+        if not os.path.exists(path) and not self._createDocumentFolder(path):
+            return
+
+        fn = os.path.normpath(os.path.join(path, name))
+        if not fn.startswith(path + os.sep):
+            self.log.error("putDocumentStream(): name outside of document: %s: %s", docid, name)
+            return
+
+        self.log.info("putDocumentStream(): %s: %s", docid, fn)
+        try:
+            folder = os.path.dirname(fn)
+            if not os.path.isdir(folder):
+                os.makedirs(folder)
+            atomicWriteStream(fn, src)
+            if name == "document.atdoc" and self.catalog:
+                st = os.stat(fn)
+                self.catalog.putBody(docid, st.st_size, st.st_mtime)
+            return True
+        except Exception as e:
+            self.log.error("putDocumentStream(): exception: %s: %s: %s", fn, e.__class__.__name__, e)
+
     def putDocumentBodyDraft(self, docid, body):
         path = os.path.join(self.docdir, docid)
 
         fn = os.path.join(path, "document.draft.atdoc")
         self.log.info("putDocumentBodyDraft(): %s: %s", docid, fn)
         try:
-            with open(fn, 'wb') as f:
-                f.write(encode(body, "utf-8"))
+            atomicWrite(fn, encode(body, "utf-8"))
             return True
         except Exception as e:
             self.log.error("putDocumentBodyDraft(): exception: %s: %s: %s", fn, e.__class__.__name__, e)
@@ -227,6 +542,10 @@ class BackendDocumentsLocal(BackendDocuments):
         self.log.info("removeDocument(): %s: %s", docid, path)
         try:
             shutil.rmtree(path, True)
+            if self.catalog:
+                self.catalog.remove(docid)
+                for digest in self.catalog.popImages(docid):
+                    self._gcImageBlob(digest)
             return True
         except Exception as e:
             self.log.error("removeDocument(): exception: %s: %s: %s", path, e.__class__.__name__, e)
@@ -234,6 +553,50 @@ class BackendDocumentsLocal(BackendDocuments):
     def localImageNamePath(self, docid, name):
         return os.path.join(self.docdir, docid, 'resources', 'images', name)
 
+    def _imageCacheKey(self, docid, localname, path):
+        return self.projectid, docid, localname, os.stat(path).st_mtime_ns
+
+    def prefetchImages(self, docid, names):
+        """ starts background decoding of document images names (resource names), does not wait """
+        if self.imagecache is None:
+            return super(BackendDocumentsLocal, self).prefetchImages(docid, names)
+
+        items = []
+        for name in set(names):
+            localname = resourceNameToLocal(name, ext='.png')
+            path = self.localImageNamePath(docid, localname)
+            try:
+                items.append((self._imageCacheKey(docid, localname, path), path))
+            except FileNotFoundError:
+                continue
+            except Exception as e:
+                self.log.error("prefetchImages(): exception: %s: %s: %s", path, e.__class__.__name__, e)
+
+        if not items:
+            return None
+        return self.imagecache.prefetch(items)
+
+    def requestImage(self, docid, name, tag):
+        if self.imagecache is None:
+            return super(BackendDocumentsLocal, self).requestImage(docid, name, tag)
+
+        localname = resourceNameToLocal(name, ext='.png')
+        path = self.localImageNamePath(docid, localname)
+
+        try:
+            key = self._imageCacheKey(docid, localname, path)
+        except FileNotFoundError:
+            self.log.error("requestImage(): could not open file: %s", path)
+            return None, False
+        except Exception as e:
+            self.log.error("requestImage(): exception: %s: %s: %s", path, e.__class__.__name__, e)
+            return None, False
+
+        image = self.imagecache.request(key, path, tag)
+        if image is None:
+            return None, True
+        return Qt.QPixmap.fromImage(image), False
+
     def getImage(self, docid, name):
         localname = resourceNameToLocal(name, ext='.png')
         path = self.localImageNamePath(docid, localname)
@@ -241,25 +604,28 @@ class BackendDocumentsLocal(BackendDocuments):
         self.log.info("getImage(): %s: %s: %s", docid, name, path)
 
         try:
-            f = Qt.QFile(path)
-            if not f.open(Qt.QFile.ReadOnly):
+            if not os.path.isfile(path):
                 self.log.error("getImage(): could not open file: %s", path)
                 return None
 
-            data = f.readAll()
-            f.close()
-            del f
-
-            image = Qt.QPixmap()
-            image.loadFromData(data)
-            data.clear()
-            del data
-            return image
+            if self.imagecache is not None:
+                image = self.imagecache.load(self._imageCacheKey(docid, localname, path), path)
+            else:
+                image = Qt.QImage(path)
+            if image is None or image.isNull():
+                return None
+            return Qt.QPixmap.fromImage(image)
         except Exception as e:
             self.log.error("getImage(): exception: %s: %s: %s", path, e.__class__.__name__, e)
 
         return None
 
+    def getImageSize(self, docid, localname):
+        try:
+            return os.path.getsize(self.localImageNamePath(docid, localname))
+        except OSError:
+            return None
+
     def getImageRaw(self, docid, name):
         localname = resourceNameToLocal(name, ext='.png')
         path = self.localImageNamePath(docid, localname)
@@ -277,28 +643,180 @@ class BackendDocumentsLocal(BackendDocuments):
 
         return None
 
+    def imageBlobPath(self, digest):
+        return os.path.join(self.imagesdir, digest[:2], digest + ".png")
+
+    @staticmethod
+    def imageDigest(image):
+        # hash of decoded pixels, much cheaper than PNG encoding
+        if not isinstance(image, Qt.QImage):
+            image = image.toImage()
+        width = image.width()
+        height = image.height()
+        digest = sha1("{0}x{1}:{2}:".format(width, height, int(image.format())).encode('ascii'))
+        bits = image.constBits()
+        bits.setsize(image.byteCount())
+        data = memoryview(bits.asstring())
+        # scanlines are padded, padding bytes are undefined
+        stride = image.bytesPerLine()
+        line = (width * image.depth() + 7) // 8
+        if line == stride:
+            digest.update(data)
+        else:
+            for y in range(height):
+                digest.update(data[y * stride:y * stride + line])
+        return digest.hexdigest()
+
+    def _linkImage(self, src, dst):
+        folder = os.path.dirname(dst)
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        fd, tmppath = tempfile.mkstemp(prefix=".link.", suffix=".tmp", dir=folder)
+        os.close(fd)
+        os.unlink(tmppath)
+        try:
+            try:
+                os.link(src, tmppath)
+            except OSError:
+                # no hardlinks on this filesystem, documents get private copies
+                shutil.copyfile(src, tmppath)
+            os.replace(tmppath, dst)
+        except:
+            if os.path.exists(tmppath):
+                os.unlink(tmppath)
+            raise
+
+    def _putImageBlob(self, digest, image):
+        path = self.imageBlobPath(digest)
+        folder = os.path.dirname(path)
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        fd, tmppath = tempfile.mkstemp(prefix=".blob.", suffix=".tmp", dir=folder)
+        os.close(fd)
+        try:
+            # TODO: support indexed colors formats like GIF?
+            if not image.save(tmppath, "PNG"):
+                raise IOError("Could not encode image")
+            if (config.durability or DURABILITY_NONE) != DURABILITY_NONE:
+                fsyncFile(tmppath)
+            os.replace(tmppath, path)
+        except:
+            if os.path.exists(tmppath):
+                os.unlink(tmppath)
+            raise
+        return path
+
+    def _copyImageBlob(self, src, path):
+        folder = os.path.dirname(path)
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        with open(src, 'rb') as f:
+            atomicWrite(path, f.read())
+
+    def _dropImageBlob(self, digest):
+        path = self.imageBlobPath(digest)
+        try:
+            self.log.info("_gcImageBlob(): %s", digest)
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            self.log.error("_gcImageBlob(): exception: %s: %s: %s", path, e.__class__.__name__, e)
+
+    def _gcImageBlob(self, digest):
+        # blob is owned by catalog images rows, removed with the last one
+        if self.catalog:
+            self.catalog.releaseImage(digest, self._dropImageBlob)
+
+    def _setImageRef(self, docid, localname, digest):
+        # reference is taken before blob is used, so it can not be collected meanwhile
+        if not self.catalog:
+            return None
+        return self.catalog.setImage(docid, localname, digest)
+
+    def _restoreImageRef(self, docid, localname, digest, prev):
+        # undo of _setImageRef() after failure
+        if not self.catalog:
+            return
+        if prev:
+            self.catalog.setImage(docid, localname, prev)
+        else:
+            self.catalog.popImage(docid, localname)
+        if digest != prev:
+            self._gcImageBlob(digest)
+
     def putImage(self, docid, name, image):
         localname = resourceNameToLocal(name, ext='.png')
         path = self.localImageNamePath(docid, localname)
 
         self.log.info("putImage(): %s: %s: %s", docid, name, path)
         try:
-            # TODO: support indexed colors formats like GIF?
-            image.save(path, "PNG")
+            digest = self.imageDigest(image)
+        except Exception as e:
+            self.log.error("putImage(): exception: %s: %s: %s", path, e.__class__.__name__, e)
+            return None
+
+        if self.catalog and self.catalog.getImage(docid, localname) == digest and os.path.isfile(path):
+            # unchanged image, nothing to do
             return localname
+
+        prev = self._setImageRef(docid, localname, digest)
+        try:
+            blob = self.imageBlobPath(digest)
+            if not os.path.isfile(blob):
+                self._putImageBlob(digest, image)
+            self._linkImage(blob, path)
         except Exception as e:
             self.log.error("putImage(): exception: %s: %s: %s", path, e.__class__.__name__, e)
+            self._restoreImageRef(docid, localname, digest, prev)
+            return None
 
-        return None
+        if prev and prev != digest:
+            self._gcImageBlob(prev)
+        return localname
+
+    def copyImage(self, docid, name, srcbackend, srcdocid):
+        if not isinstance(srcbackend, BackendDocumentsLocal):
+            return super(BackendDocumentsLocal, self).copyImage(docid, name, srcbackend, srcdocid)
+
+        localname = resourceNameToLocal(name, ext='.png')
+        src = srcbackend.localImageNamePath(srcdocid, localname)
+        path = self.localImageNamePath(docid, localname)
+
+        self.log.info("copyImage(): %s: %s: %s -> %s", srcdocid, docid, name, path)
+        digest = srcbackend.catalog.getImage(srcdocid, localname) if srcbackend.catalog else None
+        prev = self._setImageRef(docid, localname, digest) if digest else None
+        try:
+            if digest:
+                blob = self.imageBlobPath(digest)
+                if not os.path.isfile(blob):
+                    # stores never share inodes (no hardlinks across projects)
+                    self._copyImageBlob(src, blob)
+                src = blob
+
+            self._linkImage(src, path)
+        except Exception as e:
+            self.log.error("copyImage(): exception: %s: %s: %s", path, e.__class__.__name__, e)
+            if digest:
+                self._restoreImageRef(docid, localname, digest, prev)
+            return None
+
+        if prev and prev != digest:
+            self._gcImageBlob(prev)
+        return localname
 
     def clearImagesOld(self, docid, currentimages):
         path = os.path.join(self.docdir, docid, "resources", "images")
         self.log.debug("Current images: %s", ", ".join(currentimages))
         for fn in os.listdir(path):
-            if fn not in currentimages:
-                ffn = os.path.join(path, fn)
-                self.log.info("clearImagesOld(): %s", fn)
-                os.unlink(ffn)
+            if fn in currentimages:
+                continue
+            ffn = os.path.join(path, fn)
+            self.log.info("clearImagesOld(): %s", fn)
+            os.unlink(ffn)
+            digest = self.catalog.popImage(docid, fn) if self.catalog else None
+            if digest:
+                self._gcImageBlob(digest)
 
 
 create = BackendDocumentsLocal
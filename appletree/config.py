@@ -30,3 +30,49 @@ config.data_dir = "data"
 config.config_dir = os.path.join(config.data_dir, "config")
 
 config.qt = 5
+# extra consistency checks (slow)
+config.debug = False
+
+# worker threads used by backends for bulk I/O
+config.backend_workers = 8
+
+# local files write durability: none / file / dir (see appletree.backend.base.atomicWrite)
+config.durability = 'file'
+
+# ms of quiet after the last tree change before applenote.doctree is written
+config.doctree_save_delay = 2000
+# doctree changes are appended to applenote.doctree.journal, merged into snapshot after that many
+# operations or journal bytes
+config.doctree_journal_ops = 1000
+config.doctree_journal_size = 1024 * 1024
+
+# documents tabs restored at startup get their editors when shown first time
+config.tabs_lazy_restore = True
+
+# editors of documents tabs not used for that many seconds are hibernated (draft written, editor freed,
+# recreated when the tab is shown), 0: never
+config.editors_hibernate_idle = 900
+# estimated memory (bytes) of all editors above which the least recently used ones are hibernated, 0: no limit
+config.editors_memory_budget = 512 * 1024 * 1024
+# ms between hibernation checks (and status bar memory updates), 0: disabled
+config.editors_hibernate_interval = 10000
+
+# ms without changes in an editor before its draft is written in background, 0: only on close
+config.autosave_delay = 5000
+
+# remote (http/https) images
+config.cache_dir = os.path.join(config.data_dir, "cache")
+config.http_cache_size = 256 * 1024 * 1024
+config.http_timeout = 10
+# seconds cached remote image is used without revalidation, when server sends no Cache-Control/Expires
+config.http_cache_freshness = 3600
+config.remote_image_workers = 4
+
+# decoded images cache (bytes) and decoding threads
+config.image_cache_size = 128 * 1024 * 1024
+config.image_decode_workers = 4
+
+# documents tree: lazy model/view (QATTreeView) or QTreeWidget with item per document (QATTreeWidget)
+config.tree_lazy_model = True
+# rows expanded on project load (lazy model only), deeper levels are populated on expand
+config.tree_expand_rows = 2000
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+#
+#       Copyright 2017+ Jakub Kolasa <jkolczasty@gmail.com>
+#
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 3 of the License, or
+#       (at your option) any later version.
+#
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+#
+# __author__ = 'Jakub Kolasa <jkolczasty@gmail.com'>
+#
+
+
+# Documents are written in background by DocumentsWriter: writes of one document are queued and run in order,
+# different documents are written in parallel, completion callbacks run on GUI thread.
+# Drafts autosave: editors report changes with touch(), after config.autosave_delay ms without changes
+# drafts of modified editors are snapshotted (Editor.draftSnapshot(), GUI thread) and queued to the writer.
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+import logging
+from weakref import WeakSet
+from collections import deque
+from threading import Condition
+from concurrent.futures import ThreadPoolExecutor
+from appletree.config import config
+from appletree.gui.qt import Qt
+
+_autosaveScheduler = None
+
+
+class DocumentsWriter(Qt.QObject):
+    # done callback, result of write
+    completed = Qt.pyqtSignal(object, object)
+
+    def __init__(self, workers, *args):
+        super(DocumentsWriter, self).__init__(*args)
+        self.log = logging.getLogger("at.writer")
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        # key -> queue of (write, done), first one is running
+        self.queues = dict()
+        self.cond = Condition()
+        self.completed.connect(self.on_completed)
+
+    def submit(self, key, write, done=None):
+        with self.cond:
+            queue = self.queues.get(key)
+            if queue is None:
+                queue = self.queues[key] = deque()
+                self.pool.submit(self._run, key)
+            queue.append((write, done))
+
+    def _run(self, key):
+        while True:
+            with self.cond:
+                write, done = self.queues[key][0]
+            try:
+                result = write()
+            except Exception as e:
+                self.log.error("_run(): %s: %s: %s", key, e.__class__.__name__, e)
+                result = None
+            if done is not None:
+                self.completed.emit(done, result)
+            with self.cond:
+                queue = self.queues[key]
+                queue.popleft()
+                if not queue:
+                    del self.queues[key]
+                    self.cond.notify_all()
+                    return
+
+    def pending(self, key=None):
+        with self.cond:
+            return key in self.queues if key is not None else bool(self.queues)
+
+    def sync(self, key=None):
+        """ waits for queued writes of key (default: all) """
+        with self.cond:
+            while (key in self.queues) if key is not None else self.queues:
+                self.cond.wait()
+
+    def on_completed(self, done, result):
+        try:
+            done(result)
+        except Exception as e:
+            self.log.error("on_completed(): %s: %s", e.__class__.__name__, e)
+
+
+class AutosaveScheduler(Qt.QObject):
+    def __init__(self, *args):
+        super(AutosaveScheduler, self).__init__(*args)
+        self.log = logging.getLogger("at.autosave")
+        # editors changed since their last draft snapshot
+        self.dirty = WeakSet()
+        self.timer = Qt.QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.on_timeout)
+        self.writer = DocumentsWriter(config.backend_workers or 1, self)
+
+    @staticmethod
+    def key(editor):
+        return editor.project.projectid, editor.docid
+
+    def submit(self, editor, write, done=None):
+        """ queues write of editor document after its earlier writes """
+        self.writer.submit(self.key(editor), write, done)
+
+    def touch(self, editor):
+        editor.draftdirty = True
+        self.dirty.add(editor)
+        if config.autosave_delay:
+            self.timer.start(config.autosave_delay)
+
+    def snapshot(self, editor):
+        """ queues draft write of dirty and modified editor """
+        if not editor.draftdirty or not editor.isModified():
+            self.remove(editor)
+            return False
+        try:
+            write = editor.draftSnapshot()
+        except Exception as e:
+            self.log.error("snapshot(): %s: %s: %s", editor.docid, e.__class__.__name__, e)
+            return False
+        # after snapshot: it may change the document itself (e.g. inline images extraction)
+        self.remove(editor)
+        if write:
+            self.submit(editor, write, editor.draftCompletion())
+        return True
+
+    def remove(self, editor):
+        self.dirty.discard(editor)
+        editor.draftdirty = False
+
+    def cancel(self, editor):
+        """ forget pending changes of editor (reloaded), waits for its queued writes """
+        self.remove(editor)
+        self.writer.sync(self.key(editor))
+
+    def flush(self, editors=None):
+        """ writes drafts of still dirty editors (default: all) and waits for the writer """
+        count = 0
+        for editor in list(self.dirty if editors is None else editors):
+            if self.snapshot(editor):
+                count += 1
+        self.sync()
+        return count
+
+    def sync(self, key=None):
+        """ waits for queued writes of document key (projectid, docid), default: all """
+        self.writer.sync(key)
+
+    def on_timeout(self):
+        count = 0
+        for editor in list(self.dirty):
+            if self.snapshot(editor):
+                count += 1
+        if count:
+            self.log.info("on_timeout(): %s drafts queued", count)
+
+
+def getAutosaveScheduler():
+    global _autosaveScheduler
+    if not _autosaveScheduler:
+        _autosaveScheduler = AutosaveScheduler()
+    return _autosaveScheduler
@@ -22,13 +22,42 @@
 
 import logging
 import os
+import time
 from weakref import ref
 from appletree.gui.qt import Qt, QTVERSION
 from appletree.helpers import getIcon, messageDialog
+from appletree.gui.autosave import getAutosaveScheduler
 from collections import OrderedDict
 from .toolbar import Toolbar
 
 EDITORS = OrderedDict()
+# rough memory used by rich/plain text document per character (text, formats and layout)
+DOCUMENT_BYTES_PER_CHAR = 16
+
+
+class EditorPlaceholder(Qt.QWidget):
+    """ Tab of a document without editor yet, the editor is created when the tab is shown first time """
+    activated = Qt.pyqtSignal(str)
+    # editor was hibernated with unsaved changes (kept in draft)
+    modified = False
+
+    def __init__(self, docid, docname, *args):
+        super(EditorPlaceholder, self).__init__(*args)
+        self.docid = docid
+        self.docname = docname
+        self.setAccessibleName(docid)
+
+    def showEvent(self, event):
+        super(EditorPlaceholder, self).showEvent(event)
+        # tab is replaced after show completes, window paints without waiting for editor
+        Qt.QTimer.singleShot(0, self.on_shown)
+
+    def on_shown(self):
+        try:
+            self.activated.emit(self.docid)
+        except RuntimeError:
+            # tab closed in the meantime
+            pass
 
 
 class Editor(Qt.QWidget):
@@ -36,6 +65,11 @@ class Editor(Qt.QWidget):
     prevModified = False
     has_images = False
     can_print = False
+    # changed since last draft snapshot, see AutosaveScheduler
+    draftdirty = False
+    # changes counter, save completion clears modified flag only if there were no changes since snapshot
+    changes = 0
+    closed = False
 
     def __init__(self, win, project, docid, docname):
         Qt.QWidget.__init__(self)
@@ -46,6 +80,8 @@ class Editor(Qt.QWidget):
 
         self.docid = docid
         self.docname = docname
+        # last time shown or changed, least recently used editors are hibernated first
+        self.lastused = time.time()
 
         self.buildToolbar()
 
@@ -132,11 +168,13 @@ class Editor(Qt.QWidget):
 
     def closeRequest(self):
         if self.isModified():
-            self.savedraft()
+            getAutosaveScheduler().flush([self])
         return True
 
     def destroy(self, *args):
         self.log.info("Destroy")
+        self.closed = True
+        getAutosaveScheduler().remove(self)
 
         if self.elementsroot:
             self.elementsroot = None
@@ -146,26 +184,71 @@ class Editor(Qt.QWidget):
             self.elements = None
 
     def save(self, *args):
+        """ snapshot of document is taken here, it is written in background (see on_saved()) """
         self.log.info("save()")
 
+        scheduler = getAutosaveScheduler()
+        # drafts queued before are written first and dropped by the save
+        scheduler.remove(self)
         body = self.getBody()
-
-        if self.project.doc.putDocumentBody(self.docid, body):
+        backend = self.project.doc
+        docid = self.docid
+        scheduler.submit(self, lambda: backend.putDocumentBody(docid, body), self.saveCompletion())
+
+    def saveCompletion(self):
+        editor = ref(self)
+        changes = self.changes
+
+        def done(result):
+            editor_ = editor()
+            if editor_ is not None and not editor_.closed:
+                editor_.on_saved(changes, result)
+        return done
+
+    def on_saved(self, changes, result):
+        if not result:
+            self.log.error("on_saved(): save failed: %s", self.docid)
+            # keep changes at least in draft
+            self.changed()
+            return
+        if changes == self.changes:
             self.setModified(False)
 
     def savedraft(self, *args):
         self.log.info("saveDraft()")
+        self.draftdirty = True
+        getAutosaveScheduler().flush([self])
 
+    def draftSnapshot(self):
+        """ called on GUI thread, returns function writing the draft (called on autosave writer thread) """
         body = self.getBody()
+        backend = self.project.doc
+        docid = self.docid
+        return lambda: backend.putDocumentBodyDraft(docid, body)
+
+    def draftCompletion(self):
+        """ called on GUI thread after draftSnapshot(), returns callback run on GUI thread with result of write """
+        return None
+
+    def changed(self):
+        # document content changed, draft will be autosaved
+        if self.closed:
+            # document cleared in destroy()
+            return
+        self.changes += 1
+        self.lastused = time.time()
+        getAutosaveScheduler().touch(self)
 
-        self.project.doc.putDocumentBodyDraft(self.docid, body)
+    def memoryEstimate(self):
+        """ rough estimate of memory (bytes) held by the document """
+        return 0
 
     def isModified(self):
         return None
 
     def setModified(self, modified):
         win = self.win()
-        if not win:
+        if not win or self.closed:
             return
         name = self.docname if not modified else self.docname + " *"
         win.tabSetLabel(self.docid, name)
@@ -263,6 +346,7 @@ class Editor(Qt.QWidget):
                                  OkCancel=True):
                 return
 
+            getAutosaveScheduler().cancel(self)
             return self.load(draft=False)
 
     def load(self, draft=False):
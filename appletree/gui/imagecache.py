@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+#
+#       Copyright 2017+ Jakub Kolasa <jkolczasty@gmail.com>
+#
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 3 of the License, or
+#       (at your option) any later version.
+#
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+#
+# __author__ = 'Jakub Kolasa <jkolczasty@gmail.com'>
+#
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from appletree.config import config
+from appletree.gui.qt import Qt
+
+_imageCache = None
+
+
+def decodeImageFile(path):
+    # QImage (unlike QPixmap) may be used outside of GUI thread. Reader is given the path: PyQt releases the GIL
+    # while it decodes, QImage.loadFromData() keeps it and would stall GUI thread meanwhile
+    image = Qt.QImageReader(path).read()
+    if image.isNull():
+        return None
+    return image
+
+
+class ImageCache(Qt.QObject):
+    """ Process-wide LRU of decoded images, keys are (projectid, docid, name, mtime) and cost
+    is decoded size in bytes, bounded by config.image_cache_size. Images are decoded on worker threads,
+    request() results are delivered on GUI thread with decoded signal (tag, QImage or None). """
+    decoded = Qt.pyqtSignal(object, object)
+
+    def __init__(self, budget, *args):
+        super(ImageCache, self).__init__(*args)
+        self.log = logging.getLogger("at.imagecache")
+        self.budget = budget
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.images = OrderedDict()
+        # key -> [tag, ...] of images being decoded
+        self.pending = dict()
+        self.lock = Lock()
+        self.pool = ThreadPoolExecutor(max_workers=config.image_decode_workers or 1)
+
+    def get(self, key):
+        with self.lock:
+            image = self.images.get(key)
+            if image is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.images.move_to_end(key)
+            return image
+
+    def put(self, key, image):
+        cost = image.byteCount()
+        with self.lock:
+            if key in self.images:
+                return
+            if cost > self.budget:
+                return
+            self.images[key] = image
+            self.size += cost
+            while self.size > self.budget:
+                _key, _image = self.images.popitem(last=False)
+                self.size -= _image.byteCount()
+
+    def _decode(self, key, path):
+        try:
+            image = decodeImageFile(path)
+        except Exception as e:
+            self.log.error("decode: %s: %s: %s", path, e.__class__.__name__, e)
+            return None
+        if image is not None:
+            self.put(key, image)
+        return image
+
+    def load(self, key, path):
+        image = self.get(key)
+        if image is not None:
+            return image
+        return self._decode(key, path)
+
+    def _decodePending(self, key, path):
+        image = self._decode(key, path)
+        with self.lock:
+            tags = self.pending.pop(key, ())
+        for tag in tags:
+            self.decoded.emit(tag, image)
+
+    def _submit(self, key, path, tag=None):
+        # under lock: decode of key is queued once, tags are collected until it is done
+        tags = self.pending.get(key)
+        if tags is None:
+            tags = self.pending[key] = []
+            self.pool.submit(self._decodePending, key, path)
+        if tag is not None:
+            tags.append(tag)
+
+    def request(self, key, path, tag):
+        """ cached image or None: image is decoded in background and delivered with decoded signal (with tag) """
+        with self.lock:
+            image = self.images.get(key)
+            if image is not None:
+                self.hits += 1
+                self.images.move_to_end(key)
+                return image
+            self.misses += 1
+            self._submit(key, path, tag)
+        return None
+
+    def prefetch(self, items):
+        # starts decoding of missing images on worker threads, does not wait, items: [(key, path), ...]
+        with self.lock:
+            missing = [(key, path) for key, path in items if key not in self.images]
+            self.hits += len(items) - len(missing)
+            self.misses += len(missing)
+            for key, path in missing:
+                self._submit(key, path)
+        self.log.info("prefetch(): %s images, %s to decode; %s", len(items), len(missing), self.stats())
+        return len(missing)
+
+    def stats(self):
+        return "hits: {0}, misses: {1}, images: {2}, size: {3}/{4}".format(self.hits, self.misses,
+                                                                          len(self.images), self.size,
+                                                                          self.budget)
+
+
+def getImageCache():
+    global _imageCache
+    if not _imageCache:
+        _imageCache = ImageCache(config.image_cache_size)
+    return _imageCache
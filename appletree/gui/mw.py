@@ -24,18 +24,19 @@ from __future__ import absolute_import
 from __future__ import print_function
 
 import logging
+import time
 from configparser import ConfigParser
 import os.path
 from appletree.config import config
 from appletree.gui.qt import QTVERSION, Qt, QtCore
-from appletree.helpers import getIcon, T, messageDialog, processProjectDocumentsTree, \
-    listProjectDocumentsTree
+from appletree.helpers import getIcon, T, messageDialog, processProjectDocumentsTree
 from appletree.gui.toolbar import Toolbar
 from appletree.gui.utils import ObjectCallbackWrapperRef, MakeQAction
 from appletree.project import Projects
 from appletree.plugins.base import ATPlugins
 from appletree.gui.project import ProjectView, NewProjectDialog
-from appletree.gui.progressdialog import ProgressDialog
+from appletree.gui.progressdialog import ProgressDialog, ProgressTask
+from appletree.gui.autosave import getAutosaveScheduler
 from appletree.archive import AppleTreeArchive
 import traceback
 
@@ -66,6 +67,8 @@ class AppleTreeMainWindow(Qt.QMainWindow):
 
         self.projects = Projects()
         self.projectsViews = dict()
+        # background operation with progress dialog (ProgressTask)
+        self.task = None
 
         self.buildMenuProject()
         self.buildToolbar()
@@ -86,6 +89,14 @@ class AppleTreeMainWindow(Qt.QMainWindow):
         self.setCentralWidget(centralwidget)
         self.setMenuBar(self.menubar)
 
+        # editors memory estimates, see hibernateEditors()
+        self.memorylabel = Qt.QLabel()
+        self.statusBar().addPermanentWidget(self.memorylabel)
+        self.hibernatetimer = Qt.QTimer(self)
+        self.hibernatetimer.timeout.connect(self.on_hibernate_timer)
+        if config.editors_hibernate_interval:
+            self.hibernatetimer.start(config.editors_hibernate_interval)
+
         self.plugins.initialize()
         self.ready = True
         self.treeready = False
@@ -113,8 +124,9 @@ class AppleTreeMainWindow(Qt.QMainWindow):
     def buildMenuProject(self):
 
         MakeQAction(T("&Rename project (not implemented yet)"), self.menuproject, None).setEnabled(False)
-        MakeQAction(T("&Import project (not implemented yet)"), self.menuproject, None).setEnabled(False)
+        MakeQAction(T("&Import project"), self.menuproject, self.on_menu_project_import)
         MakeQAction(T("&Export project"), self.menuproject, self.on_menu_project_export)
+        MakeQAction(T("Export project (&differential)"), self.menuproject, self.on_menu_project_export_diff)
         Qt.QShortcut("CTRL+E", self, member=self.on_menu_project_export)
 
         self.menuproject.addSeparator()
@@ -241,12 +253,8 @@ class AppleTreeMainWindow(Qt.QMainWindow):
                 openeddocuments = [s.strip() for s in openeddocuments.split(",") if s]
                 activedocument = cfg.get(section, 'activedocument', fallback=None)
 
-                for docid in openeddocuments:
-                    ProgressDialog.yield_()
-                    view.open(docid)
-
-                if activedocument:
-                    view.setCurrentDocument(activedocument)
+                # editors are created when their tabs are shown
+                view.restoreTabs(openeddocuments, activedocument)
 
                 if activeproject is not None:
                     index = self.tabFind(activeproject)
@@ -307,9 +315,54 @@ class AppleTreeMainWindow(Qt.QMainWindow):
         finally:
             ProgressDialog.done()
 
+    def hibernateEditors(self):
+        """ hibernates hidden editors idle for too long, then least recently used ones while estimated memory
+        of all editors is above budget, returns [(projectid, editor, estimate)] of editors left """
+        editors = []
+        for projectid, projectv in self.projectsViews.items():
+            for editor in projectv.editors.values():
+                editors.append((projectid, editor, editor.memoryEstimate()))
+        editors.sort(key=lambda e: e[1].lastused)
+
+        total = sum(e[2] for e in editors)
+        idle = config.editors_hibernate_idle
+        budget = config.editors_memory_budget
+        now = time.time()
+        left = []
+        for projectid, editor, estimate in editors:
+            if not editor.isVisible() and ((idle and now - editor.lastused > idle) or (budget and total > budget)):
+                try:
+                    if self.projectsViews[projectid].hibernateTab(editor.docid):
+                        total -= estimate
+                        continue
+                except Exception as e:
+                    self.log.error("hibernateEditors(): %s: %s: %s", editor.docid, e.__class__.__name__, e)
+            left.append((projectid, editor, estimate))
+        return left
+
+    def updateMemoryStatus(self, editors):
+        current = self.getCurrentEditor()
+        current = current[1] if current else None
+        total = 0
+        tooltip = []
+        text = ""
+        for projectid, editor, estimate in editors:
+            total += estimate
+            tooltip.append("{0}: {1:.1f} MB".format(editor.docname, estimate / 1048576.0))
+            if editor is current:
+                text = "Document: {0:.1f} MB, ".format(estimate / 1048576.0)
+        self.memorylabel.setText(text + "editors: {0}, {1:.1f} MB".format(len(editors), total / 1048576.0))
+        self.memorylabel.setToolTip("\n".join(tooltip))
+
     def closeEvent(self, event):
+        if self.task and self.task.isRunning():
+            # task callback cleans up, e.g. removes incomplete export archive
+            self.task.cancel()
+            self.task.wait()
+
         for pv in self.projectsViews.values():
             pv.savedrafts()
+            pv.flushDocumentsTree()
 
         event.accept()
         self.save()
@@ -340,10 +393,34 @@ class AppleTreeMainWindow(Qt.QMainWindow):
         widget.destroy()
         project.active = False
 
+    def on_hibernate_timer(self):
+        self.updateMemoryStatus(self.hibernateEditors())
+
     def on_menu_project(self, projectid, *args):
         self.projectOpen(projectid)
 
     def on_menu_project_export(self, *args):
+        self.projectExport()
+
+    def on_menu_project_export_diff(self, *args):
+        self.projectExport(differential=True)
+
+    def projectExport(self, differential=False):
+        base = None
+        if differential:
+            # only changes since base archive are written
+            result = Qt.QFileDialog.getOpenFileName(self, "Select base archive", "",
+                                                    "AppleTree Project Archive (*.atarch)")
+            basefilename = result if QTVERSION == 4 else result[0]
+            if not basefilename:
+                return
+            base = AppleTreeArchive(basefilename)
+            if not base.open():
+                messageDialog(T("Project export"), T("Failed to open base archive"))
+                return
+            # its files index is all that is needed
+            base.close()
+
         result = Qt.QFileDialog.getSaveFileName(self, "Export project", "", "AppleTree Project Archive (*.atarch)")
 
         if QTVERSION == 4:
@@ -359,42 +436,117 @@ class AppleTreeMainWindow(Qt.QMainWindow):
         if not projectid:
             return
 
+        # export reads doctree and documents from backend, write pending changes first
+        projectv.flushDocumentsTree()
+        getAutosaveScheduler().sync()
         del projectv
 
+        if self.task and self.task.isRunning():
+            messageDialog(T("Project export"), T("Another operation is in progress"))
+            return
+
+        if base and projectid not in base.meta['projects']:
+            messageDialog(T("Project export"), T("Base archive does not contain this project"))
+            return
+
         arch = AppleTreeArchive(filename)
         if not arch.create():
             messageDialog(T("Failed to create archive"))
             return
+        if base:
+            try:
+                arch.setBase(base)
+            except Exception as e:
+                arch.a.close()
+                os.remove(filename)
+                messageDialog(T("Project export"), T("Base archive can not be used for differential export"),
+                              details="{0}:{1}".format(e.__class__.__name__, e))
+                return
 
-        ProgressDialog.create(0, self)
-        try:
-            project = self.projects.get(projectid)
-            arch.putProject(projectid, project.name)
-            documents = listProjectDocumentsTree(project)
-            c = len(documents)
-            i = 0
-            for docid in documents:
-                i += 1
-                ProgressDialog.progress(i * 100 / c)
-                body = project.doc.getDocumentBody(docid)
-                meta = project.doc.getDocumentMeta(docid)
-                images = project.doc.getImages(docid)
+        project = self.projects.get(projectid)
+        # tree and metadata are taken here, documents are read and written by the task
+        doctree = project.docTree()
+        metas = project.doc.getDocumentsMetaBulk(doctree.ids)
 
-                arch.putDocument(projectid, docid, meta, body)
-                for image in images:
-                    ProgressDialog.yield_()
-                    data = project.doc.getImageRaw(docid, image)
-                    arch.putDocumentImage(projectid, docid, image, data)
+        def export(progress, cancelled):
+            return arch.exportProject(project, doctree, metas, progress=progress, cancelled=cancelled)
+
+        def finished(result, error):
+            self.task = None
+            if result and arch.close():
+                messageDialog(T("Project export"), T("Project exported successfully"))
+                return
+            if arch.a:
+                arch.a.close()
+            try:
+                os.remove(filename)
+            except Exception as e:
+                self.log.error("Failed to remove incomplete archive: %s: %s", e.__class__.__name__, e)
+            if result is False and task.isCancelled():
+                return
+            details = "{0}:{1}".format(error.__class__.__name__, error) if error else None
+            messageDialog(T("Project export failed"), T("Project export failed"), details=details)
+
+        task = self.task = ProgressTask(self, export, finished)
+        task.start()
+
+    def on_menu_project_import(self, *args):
+        result = Qt.QFileDialog.getOpenFileName(self, "Import project", "", "AppleTree Project Archive (*.atarch)")
+
+        if QTVERSION == 4:
+            filename = result
+        else:
+            filename, selectedfilter = result
+
+        if not filename:
+            return
+
+        if self.task and self.task.isRunning():
+            messageDialog(T("Project import"), T("Another operation is in progress"))
+            return
 
+        arch = AppleTreeArchive(filename)
+        if not arch.open():
+            messageDialog(T("Project import"), T("Failed to open archive"))
+            return
+
+        # archived projectid -> new local project, existing projects are never overwritten
+        imported = []
+        for srcprojectid, name in arch.meta['projects'].items():
+            projectid = self.projectCreate(name, 'local', None, projectid=srcprojectid)
+            if not projectid:
+                projectid = self.projectCreate(name + " " + T("(imported)"), 'local', None)
+            project = self.projects.open(projectid) if projectid else None
+            if not project:
+                arch.close()
+                messageDialog(T("Project import failed"), T("Failed to create project: ") + name)
+                return
+            imported.append((srcprojectid, project))
+
+        def import_(progress, cancelled):
+            for srcprojectid, project in imported:
+                if not arch.importProject(srcprojectid, project.doc, progress=progress, cancelled=cancelled):
+                    return False
+            return True
+
+        def finished(result, error):
+            self.task = None
             arch.close()
-            ProgressDialog.done()
-            messageDialog(T("Project export"), T("Project exported successfully"))
-        except Exception as e:
-            self.log.error("Failed to export: %s: %s", e.__class__.__name__, e)
-            messageDialog(T("Project export failed"), T("Project export failed"),
-                          details="{0}:{1}".format(e.__class__.__name__, e))
-        finally:
-            ProgressDialog.done()
+            for srcprojectid, project in imported:
+                self.projectAdd(project.projectid)
+            if result:
+                for srcprojectid, project in imported:
+                    self.projectOpen(project.projectid)
+                return
+            if task.isCancelled():
+                messageDialog(T("Project import"), T("Project import cancelled, partially imported project was kept"))
+                return
+            details = "{0}:{1}".format(error.__class__.__name__, error) if error else None
+            messageDialog(T("Project import failed"), T("Project import failed, partially imported project was kept"),
+                          details=details)
+
+        task = self.task = ProgressTask(self, import_, finished)
+        task.start()
 
     def on_toolbar_insert_image(self, *args):
         projectid, projectv = self.getCurrentProject()
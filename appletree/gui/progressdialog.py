@@ -6,7 +6,8 @@ from __future__ import absolute_import
 from __future__ import print_function
 
 # __author__ = 'Jakub Kolasa <jakub@arker.pl'>
-
+import logging
+import threading
 from appletree.gui.qt import Qt
 from appletree.helpers import T
 _progress = None
@@ -28,16 +29,17 @@ class ProgressDialog(Qt.QProgressDialog):
                 self._cancebutton = Qt.QPushButton(self)
                 self._cancebutton.setText("Cancel")
                 self.setCancelButton(self._cancebutton)
+                self.canceled.connect(cancelcb)
         else:
             self.setCancelButtonText("")
         self.reset()
 
     @staticmethod
-    def create(delay=1, win=None):
+    def create(delay=1, win=None, cancelcb=None):
         global _progress
 
         if not _progress:
-            _progress = ProgressDialog(win)
+            _progress = ProgressDialog(win, cancelcb=cancelcb, showcancel=bool(cancelcb))
         _progress.setMinimumDuration(delay*1000)
 
     @staticmethod
@@ -46,7 +48,7 @@ class ProgressDialog(Qt.QProgressDialog):
         if not _progress:
             ProgressDialog.create()
 
-        _progress.setValue(value)
+        _progress.setValue(int(value))
 
     @staticmethod
     def done():
@@ -64,3 +66,67 @@ class ProgressDialog(Qt.QProgressDialog):
     @staticmethod
     def yield_():
         Qt.QApplication.processEvents()
+
+
+class ProgressTask(Qt.QObject):
+    """ Runs func(progress, cancelled) on a background thread with ProgressDialog shown (its Cancel sets
+    cancelled), the event loop keeps running. callback(result, error) is called on GUI thread when done. """
+    progressed = Qt.pyqtSignal(int)
+    finished = Qt.pyqtSignal(object, object)
+
+    def __init__(self, win, func, callback=None):
+        super(ProgressTask, self).__init__(win)
+        self.log = logging.getLogger("at.progresstask")
+        self.win = win
+        self.func = func
+        self.callback = callback
+        self.cancelled = False
+        self.thread = None
+        # (result, error) of func, set before finished is emitted
+        self.result = None
+        self.done = False
+        self.progressed.connect(ProgressDialog.progress)
+        self.finished.connect(self.on_finished)
+
+    def start(self, delay=0):
+        ProgressDialog.create(delay, self.win, cancelcb=self.cancel)
+        self.thread = threading.Thread(target=self._run, name="progresstask")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def cancel(self):
+        self.cancelled = True
+
+    def isCancelled(self):
+        return self.cancelled
+
+    def isRunning(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def wait(self):
+        """ blocks until func returns, then delivers finished (callback is called before return) """
+        if self.thread is not None:
+            self.thread.join()
+        if self.result is not None:
+            self.on_finished(*self.result)
+
+    def _run(self):
+        result = None
+        error = None
+        try:
+            result = self.func(self.progressed.emit, self.isCancelled)
+        except Exception as e:
+            self.log.error("_run(): %s: %s", e.__class__.__name__, e)
+            error = e
+        self.result = (result, error)
+        self.finished.emit(result, error)
+
+    def on_finished(self, result, error):
+        # queued finished may come after wait() called it already
+        if self.done:
+            return
+        self.done = True
+        ProgressDialog.done()
+        if self.callback:
+            self.callback(result, error)
+        self.deleteLater()
@@ -23,19 +23,25 @@
 from __future__ import absolute_import
 from __future__ import print_function
 
+import time
 import logging
 from weakref import ref
 from copy import copy
+from contextlib import contextmanager
+from appletree.config import config
 from appletree.gui.qt import Qt, QtCore
 from appletree.gui.toolbar import Toolbar
-from appletree.helpers import genuid, getIcon, getIconPixmap, T, messageDialog, tagsSortKey
-from appletree.gui.editor import Editor
+from appletree.helpers import genuid, getIcon, T, messageDialog, tagsSortKey, walkDocumentsTree
+from appletree.gui.editor import Editor, EditorPlaceholder
+from appletree.gui.autosave import getAutosaveScheduler
+from appletree.gui.imagecache import getImageCache
 
 from appletree.gui.rteditor import RTEditor
 from appletree.gui.pteditor import PTEditor
 from appletree.gui.tableeditor import TableEditor
 
-from appletree.gui.treeview import QATTreeWidget
+from appletree.gui.treeview import QATTreeWidget, QATTreeView, TagsItemDelegate
+from appletree.gui.treemodel import DocumentsTreeNode
 from appletree.gui.consts import TREE_COLUMN_NAME, TREE_COLUMN_UID, TREE_COLUMN_COUNT, TREE_COLUMN_ICON, \
     TREE_ITEM_FLAGS, TREE_COLUMN_ICON_WIDTH, TREE_COLUMN_TAGS
 
@@ -51,13 +57,24 @@ class ProjectView(Qt.QWidget):
         self.setAccessibleName(project.projectid)
 
         self.project = project
+        project.doc.imagecache = getImageCache()
 
         self.log = logging.getLogger("at.project." + project.projectid)
         self.editors = dict()
+        # docid -> QTreeWidgetItem (or DocumentsTreeNode for QATTreeView)
+        self.treeindex = dict()
+        # [(parent, item), ...] while in bulkInsert()
+        self.bulk = None
+        # QATTreeView: DocTree and metas the tree nodes are created from, on demand
+        self.treesource = None
+        self.treemetas = None
 
         splitter = Qt.QSplitter()
         box = Qt.QVBoxLayout()
-        tree = QATTreeWidget(self)
+        if config.tree_lazy_model:
+            tree = QATTreeView(self)
+        else:
+            tree = QATTreeWidget(self)
 
         tabs = Qt.QTabWidget()
         tabs.setTabsClosable(True)
@@ -76,7 +93,9 @@ class ProjectView(Qt.QWidget):
         tree.setColumnHidden(TREE_COLUMN_UID, True)
         tree.setColumnHidden(TREE_COLUMN_TAGS, True)
         tree.setColumnWidth(TREE_COLUMN_ICON, TREE_COLUMN_ICON_WIDTH)
-        tree.setRootIsDecorated(False)
+        tree.setItemDelegateForColumn(TREE_COLUMN_ICON, TagsItemDelegate(tree))
+        # lazy tree is not fully expanded, keep expand arrows for top level
+        tree.setRootIsDecorated(bool(config.tree_lazy_model))
 
         self.setLayout(box)
         self.buildToolbar()
@@ -102,6 +121,13 @@ class ProjectView(Qt.QWidget):
         # self.tree.setSortingEnabled(True)
         # self.tree.sortByColumn(0, QtCore.Qt.Qt_)
 
+        # doctree saves are coalesced and flushed after config.doctree_save_delay ms of quiet
+        self.treedirty = False
+        self.treesavesavoided = 0
+        self.treesavetimer = Qt.QTimer(self)
+        self.treesavetimer.setSingleShot(True)
+        self.treesavetimer.timeout.connect(self.flushDocumentsTree)
+
         self.ready = True
         self.treeready = False
 
@@ -129,6 +155,10 @@ class ProjectView(Qt.QWidget):
         for editor in self.editors.values():
             if editor.isModified():
                 modified += 1
+        for i in range(self.tabs.count()):
+            tab = self.tabs.widget(i)
+            if isinstance(tab, EditorPlaceholder) and tab.modified:
+                modified += 1
 
         return modified
 
@@ -144,33 +174,108 @@ class ProjectView(Qt.QWidget):
 
     def close(self):
         self.log.info("Close project")
+        self.flushDocumentsTree()
         super(ProjectView, self).close()
         for editor in self.editors.values():
             editor.close()
             editor.destroy()
 
         self.editors = {}
-
-    def _processDocumentsTree(self, docid, docname, items, parent, meta={}):
-        self.addDocumentTree(docid, docname, parent, meta)
-
-        for childdocid, childdocname, childitems in items:
-            childmeta = self.project.doc.getDocumentMeta(childdocid)
-            self._processDocumentsTree(childdocid, childdocname, childitems, docid, childmeta)
+        self.treeindex = {}
+        self.treesource = None
+        self.treemetas = None
 
     def loadDocumentsTree(self):
         self.treeready = False
 
-        backend = self.project.doc
-        doctree = backend.getDocumentsTree()
+        doctree = self.project.docTree()
         if not doctree:
             self.treeready = True
             return
-        for docid, docname, items in doctree:
-            self._processDocumentsTree(docid, docname, items, None)
+
+        metas = self.project.doc.getDocumentsMetaBulk(doctree.ids)
+        if isinstance(self.tree, QATTreeView):
+            start = time.time()
+            self.treesource = doctree
+            self.treemetas = metas
+            self.tree.setSource(doctree, self.newTreeSourceItem)
+            self.tree.resizeColumnToContents(TREE_COLUMN_NAME)
+            self.tree.resizeColumnToContents(TREE_COLUMN_ICON)
+            self.log.info("loadDocumentsTree(): %s documents, %s nodes created in %.3f s", len(doctree),
+                          len(self.treeindex), time.time() - start)
+        else:
+            with self.bulkInsert(reload=True):
+                for docid, docname, parent, depth in doctree.walk():
+                    self.addDocumentTree(docid, docname, parent, metas.get(docid) or {})
 
         self.treeready = True
 
+    @contextmanager
+    def bulkInsert(self, reload=False):
+        """ addDocumentTree() creates detached items only, subtrees are built bottom-up and attached
+        level at once on exit, with tree updates and signals suspended and columns resized once """
+        if self.bulk is not None:
+            yield
+            return
+
+        tree = self.tree
+        start = time.time()
+        self.bulk = []
+        tree.setUpdatesEnabled(False)
+        signals = tree.blockSignals(True)
+        if reload:
+            tree.beginLoad()
+        try:
+            yield
+        finally:
+            pending = self.bulk
+            self.bulk = None
+            try:
+                self._bulkAttach(pending)
+            finally:
+                if reload:
+                    tree.endLoad()
+                tree.blockSignals(signals)
+                tree.setUpdatesEnabled(True)
+
+            tree.resizeColumnToContents(TREE_COLUMN_NAME)
+            tree.resizeColumnToContents(TREE_COLUMN_ICON)
+            self.log.info("bulkInsert(): %s documents in %.3f s", len(pending), time.time() - start)
+
+    def _bulkAttach(self, pending):
+        detached = set(id(item) for parent, item in pending)
+        groups = dict()
+        order = []
+        for parent, item in pending:
+            key = id(parent)
+            children = groups.get(key)
+            if children is None:
+                children = groups[key] = (parent, [])
+                order.append(key)
+            children[1].append(item)
+
+        # build detached subtrees first, then attach them to the live tree
+        live = []
+        for key in order:
+            parent, children = groups[key]
+            if key in detached:
+                parent.addChildren(children)
+            else:
+                live.append((parent, children))
+
+        root = self.tree.invisibleRootItem()
+        for parent, children in live:
+            if parent is None:
+                continue
+            if parent is root:
+                self.tree.addTopLevelItems(children)
+            else:
+                parent.addChildren(children)
+
+        # QTreeWidgetItem can be expanded only when in the tree
+        for parent, item in pending:
+            item.setExpanded(True)
+
     def getDocumentTree(self, root=None, docid=None):
         # WARN: changed return value!
         count = 0
@@ -182,14 +287,21 @@ class ProjectView(Qt.QWidget):
             if not root:
                 return tree, count
         count = 1
-        for i in range(0, root.childCount()):
-            child = root.child(i)
-            # name, docbackend, docid
-            docname = child.text(TREE_COLUMN_NAME)
-            docid = child.text(TREE_COLUMN_UID)
-            children, childrencount = self.getDocumentTree(child)
-            count += childrencount
-            tree.append((docid, docname, children))
+        stack = [(root, tree)]
+        while stack:
+            item, items = stack.pop()
+            if self.treeItemPending(item):
+                # subtree nodes not created yet, read from doctree
+                docid = item.text(TREE_COLUMN_UID)
+                items.extend(self.treesource.toList(docid)[0][2])
+                count += self.treesource.subtreeSize(docid) - 1
+                continue
+            for i in range(0, item.childCount()):
+                child = item.child(i)
+                children = []
+                items.append((child.text(TREE_COLUMN_UID), child.text(TREE_COLUMN_NAME), children))
+                stack.append((child, children))
+                count += 1
 
         return tree, count
 
@@ -197,6 +309,18 @@ class ProjectView(Qt.QWidget):
         if not self.treeready:
             return
 
+        if self.treedirty:
+            self.treesavesavoided += 1
+        self.treedirty = True
+        self.treesavetimer.start(config.doctree_save_delay or 0)
+
+    def flushDocumentsTree(self):
+        self.treesavetimer.stop()
+        if not self.treedirty:
+            return
+        self.treedirty = False
+        self.log.info("flushDocumentsTree(): doctree saves avoided so far: %s", self.treesavesavoided)
+
         backend = self.project.doc
 
         root = self.tree.invisibleRootItem()
@@ -204,24 +328,51 @@ class ProjectView(Qt.QWidget):
 
         backend.setDocumentsTree(tree)
 
-    def treeFindDocument(self, docid):
-        items = self.tree.findItems(docid, QtCore.Qt.MatchFixedString | QtCore.Qt.MatchRecursive, TREE_COLUMN_UID)
-        if items:
-            return items[0]
+    def treeItemPending(self, item):
+        # QATTreeView node with children still in treesource
+        return isinstance(item, DocumentsTreeNode) and item.pending is not None
+
+    def treeItemChildren(self, item):
+        # created children only, pending nodes have nothing in treeindex
+        if self.treeItemPending(item):
+            return []
+        return [item.child(i) for i in range(0, item.childCount())]
+
+    def treeIndexRemove(self, item):
+        stack = [item]
+        while stack:
+            item = stack.pop()
+            docid = item.text(TREE_COLUMN_UID)
+            if docid and self.treeindex.get(docid) is item:
+                del self.treeindex[docid]
+            stack.extend(self.treeItemChildren(item))
 
-        return None
+    def treeFindDocument(self, docid):
+        item = self.treeindex.get(docid)
+        if item is None and self.treesource is not None and docid in self.treesource:
+            # create nodes down from top level, missing ancestor: document was removed
+            for parentid in reversed(self.treesource.ancestors(docid)):
+                parent = self.treeindex.get(parentid)
+                if parent is None:
+                    return None
+                parent.buildChildren()
+            item = self.treeindex.get(docid)
+        return item
 
     def treeRemoveDocument(self, docid):
-        items = self.tree.findItems(docid, QtCore.Qt.MatchFixedString | QtCore.Qt.MatchRecursive, TREE_COLUMN_UID)
-        if items:
-            item = items[0]
+        item = self.treeindex.get(docid)
+        if not item:
+            return
+
+        self.treeIndexRemove(item)
+        if not self.treeItemPending(item):
             for child in item.takeChildren():
                 del child
-            parent = item.parent()
-            if not parent:
-                parent = self.tree.invisibleRootItem()
-            index = parent.indexOfChild(item)
-            parent.takeChild(index)
+        parent = item.parent()
+        if not parent:
+            parent = self.tree.invisibleRootItem()
+        index = parent.indexOfChild(item)
+        parent.takeChild(index)
 
     def addDocumentTree(self, docid, name, parent, meta={}):
         if parent:
@@ -230,26 +381,41 @@ class ProjectView(Qt.QWidget):
         else:
             parent = self.tree.invisibleRootItem()
 
+        if self.bulk is not None:
+            item = self.newTreeItem(None, docid, name, meta)
+            self.bulk.append((parent, item))
+        else:
+            item = self.newTreeItem(parent, docid, name, meta)
+
+        if self.treeready and self.bulk is None:
+            # in bulkInsert() columns are resized once, at the end
+            self.tree.resizeColumnToContents(TREE_COLUMN_NAME)
+            self.tree.resizeColumnToContents(TREE_COLUMN_ICON)
+        return item
+
+    def newTreeSourceItem(self, docid, name):
+        return self.newTreeItem(None, docid, name, self.treemetas.get(docid) or {})
+
+    def newTreeItem(self, parent, docid, name, meta):
+        # parent None: detached item
         tags = meta.get('tags') or ""
         tags = [t.strip() for t in tags.split(",") if t]
+        tags.sort(key=tagsSortKey)
 
         columns = [None] * TREE_COLUMN_COUNT
         columns[TREE_COLUMN_NAME] = name
         columns[TREE_COLUMN_UID] = docid
 
-        item = Qt.QTreeWidgetItem(parent, columns)
+        item = self.tree.newItem(parent, columns)
         # item.setFirstColumnSpanned(True)
         item.setText(TREE_COLUMN_NAME, name)
         item.setText(TREE_COLUMN_UID, docid)
-        item.setText(TREE_COLUMN_TAGS, "")
+        # tags come from meta already, no need to push them back with tagDocuemntTree()
+        item.setText(TREE_COLUMN_TAGS, ",".join(tags))
         item.setIcon(TREE_COLUMN_NAME, getIcon("icon-document-default"))
         item.setExpanded(True)
         item.setFlags(TREE_ITEM_FLAGS)
-
-        self.tagDocuemntTree(treeitem=item, addtags=tags)
-
-        self.tree.resizeColumnToContents(TREE_COLUMN_NAME)
-        self.tree.resizeColumnToContents(TREE_COLUMN_ICON)
+        self.treeindex[docid] = item
         return item
 
     def tagDocuemntTree(self, docid=None, treeitem=None, tags=None, addtags=None, removetags=None, toggletags=None):
@@ -294,50 +460,11 @@ class ProjectView(Qt.QWidget):
         tags2joined = ",".join(tags2)
         treeitem.setText(TREE_COLUMN_TAGS, tags2joined)
 
-        widget = self.tree.itemWidget(treeitem, TREE_COLUMN_ICON)
-        if widget:
-            widget.destroy()
-
-        icons = Qt.QWidget(self.tree)
-        layout = Qt.QHBoxLayout()
-        icons.setLayout(layout)
-        layout.setContentsMargins(1, 1, 1, 1)
-        h = self.tree.visualItemRect(treeitem).height() - 2  # -2 = margin
-        ww = 0
-        i = 0
-        layout.insertStretch(-1, 100)
-
-        for tag in tags2:
-            label = Qt.QLabel()
-            pixmap = getIconPixmap("icon-tag-{0}".format(tag))
-            if not pixmap or pixmap.isNull():
-                self.log.error("Missing tag icon: %s", tag)
-                continue
-            # not sure if it will work correcly on all platforms
-            pixmap2 = pixmap.scaledToHeight(h)
-            w = pixmap2.width()
-            label.setFixedHeight(h)
-            label.setFixedWidth(w)
-            label.setMaximumWidth(w)
-            label.setMargin(0)
-            label.setContentsMargins(0, 0, 0, 0)
-            label.setSizePolicy(Qt.QSizePolicy.Preferred, Qt.QSizePolicy.Preferred)
-            ww += w
-            del pixmap
-
-            label.setPixmap(pixmap2)
-            layout.setStretch(i, 0)
-            layout.addWidget(label)
-            i += 1
-
-        widget = Qt.QWidget()
-        widget.setFixedHeight(h)
-        docid = treeitem.text(TREE_COLUMN_UID)
-        icons.setLayout(layout)
-
-        self.tree.setItemWidget(treeitem, TREE_COLUMN_ICON, icons)
+        # tags icons are painted by TagsItemDelegate from TREE_COLUMN_TAGS text
+        self.tree.update(self.tree.indexFromItem(treeitem, TREE_COLUMN_ICON))
         self.tree.resizeColumnToContents(TREE_COLUMN_ICON)
 
+        docid = treeitem.text(TREE_COLUMN_UID)
         self.project.doc.updateDocumentMeta(docid, dict(tags=tags2joined))
 
     def getCurrentDocument(self):
@@ -368,7 +495,8 @@ class ProjectView(Qt.QWidget):
             if tab.accessibleName() == uid:
                 return i
 
-    def open(self, docid, name=None):
+    def open(self, docid, name=None, lazy=False):
+        """ opens document tab, lazy: with placeholder, editor is created when tab is shown """
         idx = self.tabFind(docid)
         if idx is not None:
             self.tabs.setCurrentIndex(idx)
@@ -380,12 +508,16 @@ class ProjectView(Qt.QWidget):
                 return
             name = item.text(TREE_COLUMN_NAME)
 
-        meta = self.project.doc.getDocumentMeta(docid)
-        _type = meta.get('type') or 'richtext'
-        tabeditor = Editor.Editor(_type, self, self.project, docid, name)
+        if lazy:
+            placeholder = EditorPlaceholder(docid, name)
+            placeholder.activated.connect(self.on_placeholder_activated)
+            self.tabs.addTab(placeholder, name)
+            if self.tabs.count() == 1:
+                self.tabs.show()
+            return
+
+        tabeditor = self.createEditor(docid, name)
         if not tabeditor:
-            messageDialog("Unknown document type", "Unknown document type. Could not find suitable editor for it.",
-                          details=_type)
             return
 
         self.editors[docid] = tabeditor
@@ -398,6 +530,91 @@ class ProjectView(Qt.QWidget):
 
         self.tabs.setCurrentIndex(c - 1)
 
+    def createEditor(self, docid, name):
+        meta = self.project.doc.getDocumentMeta(docid)
+        _type = meta.get('type') or 'richtext'
+        tabeditor = Editor.Editor(_type, self, self.project, docid, name)
+        if not tabeditor:
+            messageDialog("Unknown document type", "Unknown document type. Could not find suitable editor for it.",
+                          details=_type)
+        return tabeditor
+
+    def restoreTabs(self, docids, current=None):
+        """ documents tabs with placeholders, only shown tab gets its editor """
+        self.tabs.blockSignals(True)
+        try:
+            for docid in docids:
+                self.open(docid, lazy=bool(config.tabs_lazy_restore))
+        finally:
+            self.tabs.blockSignals(False)
+
+        if current:
+            self.setCurrentDocument(current)
+
+    def reviveTab(self, docid):
+        """ replaces placeholder tab of docid with its editor """
+        index = self.tabFind(docid)
+        if index is None:
+            return None
+        placeholder = self.tabs.widget(index)
+        if not isinstance(placeholder, EditorPlaceholder):
+            return None
+
+        start = time.time()
+        # draft written on hibernation must be there before load
+        getAutosaveScheduler().sync((self.project.projectid, docid))
+        tabeditor = self.createEditor(docid, placeholder.docname)
+        if not tabeditor:
+            return None
+
+        current = self.tabs.currentIndex() == index
+        self.tabs.blockSignals(True)
+        try:
+            self.tabs.removeTab(index)
+            self.tabs.insertTab(index, tabeditor, placeholder.docname)
+            if current:
+                self.tabs.setCurrentIndex(index)
+        finally:
+            self.tabs.blockSignals(False)
+        placeholder.deleteLater()
+
+        self.editors[docid] = tabeditor
+        tabeditor.setModified(tabeditor.isModified())
+        self.log.info("reviveTab(): %s in %.3f s", docid, time.time() - start)
+        return tabeditor
+
+    def hibernateTab(self, docid):
+        """ replaces editor of docid with placeholder, draft of unsaved changes is written first """
+        editor = self.editors.get(docid)
+        index = self.tabFind(docid)
+        if editor is None or index is None:
+            return False
+
+        modified = editor.isModified()
+        if modified and editor.draftdirty and not getAutosaveScheduler().snapshot(editor):
+            # changes would be lost
+            return False
+
+        placeholder = EditorPlaceholder(docid, editor.docname)
+        placeholder.modified = bool(modified)
+        placeholder.activated.connect(self.on_placeholder_activated)
+        current = self.tabs.currentWidget()
+        label = self.tabs.tabText(index)
+        self.tabs.blockSignals(True)
+        try:
+            self.tabs.removeTab(index)
+            self.tabs.insertTab(index, placeholder, label)
+            if current is not editor:
+                self.tabs.setCurrentWidget(current)
+        finally:
+            self.tabs.blockSignals(False)
+
+        del self.editors[docid]
+        editor.destroy()
+        editor.deleteLater()
+        self.log.info("hibernateTab(): %s", docid)
+        return True
+
     def tabSetLabel(self, uid, label):
         idx = self.tabFind(uid)
         if idx is None:
@@ -413,26 +630,7 @@ class ProjectView(Qt.QWidget):
             # TODO: notify about desync/fail?
             return None
 
-        # first getimages, couse this method can change body settings
-        images = editor.getImages()
-        imageslocal = []
-        body = editor.getBody()
-        # save images
-        for res in images:
-            if res.startswith('data:image/'):
-                # ignore inline encoded images
-                continue
-            url = Qt.QUrl()
-            url.setUrl(res)
-            resobj = editor.doc.resource(Qt.QTextDocument.ImageResource, url)
-
-            localname = self.project.doc.putImage(docid, res, resobj)
-            if localname:
-                imageslocal.append(localname)
-
-        self.project.doc.putDocumentBody(docid, body)
-        self.project.doc.clearImagesOld(docid, imageslocal)
-        editor.setModified(False)
+        editor.save()
 
     def saveall(self, *args):
         for editor in self.editors.values():
@@ -444,17 +642,19 @@ class ProjectView(Qt.QWidget):
             editor.save()
 
     def savedrafts(self):
-        for editor in self.editors.values():
-            docid = editor.docid
-            if not editor.isModified():
-                continue
-
-            self.log.info("savedrafts(): %s", docid)
-            editor.savedraft()
+        # only drafts changed since last autosave are written
+        count = getAutosaveScheduler().flush(self.editors.values())
+        self.log.info("savedrafts(): %s drafts written", count)
 
     def _cloneDocuments(self, srcuid, srcname, items, parent, srcprojectv):
-        dstuid = genuid()
-
+        # parents are cloned before children, src docid -> new docid
+        uids = dict()
+        for srcuid, srcname, srcparent, depth in walkDocumentsTree([(srcuid, srcname, items)]):
+            dstuid = uids[srcuid] = genuid()
+            dstparent = parent if srcparent is None else uids[srcparent]
+            self._cloneDocument(srcuid, srcname, dstuid, dstparent, srcprojectv)
+
+    def _cloneDocument(self, srcuid, srcname, dstuid, parent, srcprojectv):
         docmeta = srcprojectv.project.doc.getDocumentMeta(srcuid)
         docbody = srcprojectv.project.doc.getDocumentBody(srcuid)
         docbodydraft = srcprojectv.project.doc.getDocumentBodyDraft(srcuid)
@@ -466,14 +666,10 @@ class ProjectView(Qt.QWidget):
             self.project.doc.putDocumentBodyDraft(dstuid, docbodydraft)
 
         for image in images:
-            __image = srcprojectv.project.doc.getImage(srcuid, image)
-            self.project.doc.putImage(dstuid, image, __image)
+            self.project.doc.copyImage(dstuid, image, srcprojectv.project.doc, srcuid)
 
         self.addDocumentTree(dstuid, srcname, parent, docmeta)
 
-        for childsrcuid, childsrcname, childitems in items:
-            self._cloneDocuments(childsrcuid, childsrcname, childitems, dstuid, srcprojectv)
-
     def cloneDocuments(self, srcprojectid, srcdocumentid, dstdocumentid):
         """ clone documents from source project:document to this:document"""
 
@@ -486,6 +682,8 @@ class ProjectView(Qt.QWidget):
             return
 
         srcprojectv = win.projectsViews.get(srcprojectid)
+        # documents are read from backend, queued saves first
+        getAutosaveScheduler().sync()
         if not srcdocumentid:
             self.log.warn("Can't clone documents, src project is not opened: %s", srcprojectid)
             return
@@ -506,25 +704,26 @@ class ProjectView(Qt.QWidget):
                                  OkCancel=True):
                 return
 
-            self._cloneDocuments(srcdocumentid, srcname, doctree, dstdocumentid, srcprojectv)
+            with self.bulkInsert():
+                self._cloneDocuments(srcdocumentid, srcname, doctree, dstdocumentid, srcprojectv)
         finally:
             self.treeready = True
         self.saveDocumentsTree()
 
     def closeTreeTabs(self, docid, items):
-        index = self.tabFind(docid)
-        if index is not None:
-            self.on_tab_close_req(index, ignoreChanges=True)
-
-        for childuid, childname, childitems in items:
-            self.closeTreeTabs(childuid, childitems)
+        for docid, docname, parent, depth in walkDocumentsTree([(docid, None, items)]):
+            index = self.tabFind(docid)
+            if index is not None:
+                self.on_tab_close_req(index, ignoreChanges=True)
 
     def removeDocuments(self, docid, items):
-        for childuid, childname, childitems in items:
-            self.removeDocuments(childuid, childitems)
-
-        self.treeRemoveDocument(docid)
-        self.project.doc.removeDocument(docid)
+        scheduler = getAutosaveScheduler()
+        # children first
+        for docid, docname, parent, depth in walkDocumentsTree([(docid, None, items)], order='post'):
+            self.treeRemoveDocument(docid)
+            # queued save or draft would recreate removed document
+            scheduler.sync((self.project.projectid, docid))
+            self.project.doc.removeDocument(docid)
 
     def removeDocument(self, docid):
         if not self.treeready:
@@ -585,6 +784,7 @@ class ProjectView(Qt.QWidget):
         return False
 
     def on_tree_drop_after_event(self):
+        # internal move keeps the same items, docid -> item index stays valid
         if not self.treeready:
             return
         self.log.info("on_tree_drop_after_event()")
@@ -610,6 +810,14 @@ class ProjectView(Qt.QWidget):
         if self.tabs.count() == 0:
             self.tabs.hide()
 
+        self.flushDocumentsTree()
+
+    def on_placeholder_activated(self, docid):
+        index = self.tabFind(docid)
+        # still shown: could be switched away before the timer fired
+        if index is not None and index == self.tabs.currentIndex() and self.isVisible():
+            self.reviveTab(docid)
+
     def on_tab_current_changed(self, index):
         widget = self.tabs.widget(index)
         if not widget:
@@ -617,6 +825,9 @@ class ProjectView(Qt.QWidget):
 
         docid = widget.accessibleName()
         self.log.info("on_tab_current_changed(): docid %s", docid)
+        editor = self.editors.get(docid)
+        if editor:
+            editor.lastused = time.time()
         treeitem = self.treeFindDocument(docid)
         if treeitem:
             self.tree.setCurrentItem(treeitem)
@@ -24,7 +24,7 @@
 import os
 from appletree.gui.qt import QTVERSION, Qt, QtCore, loadQImageFix
 from appletree.helpers import T, genuid, messageDialog
-from .editor import Editor, EDITORS
+from .editor import Editor, EDITORS, DOCUMENT_BYTES_PER_CHAR
 
 
 class PTEditor(Editor):
@@ -67,6 +67,7 @@ class PTEditor(Editor):
         self.doc = self.editor.document()
         self.doc.setPlainText(docbody)
         self.setModified(draft)
+        self.draftdirty = False
 
     def destroy(self, *args):
         super(PTEditor, self).destroy(*args)
@@ -89,6 +90,11 @@ class PTEditor(Editor):
     def getBody(self):
         return self.editor.toPlainText()
 
+    def memoryEstimate(self):
+        if not self.doc:
+            return 0
+        return self.doc.characterCount() * DOCUMENT_BYTES_PER_CHAR
+
     def on_toolbar_editor_action(self, name):
         return None
 
@@ -96,6 +102,7 @@ class PTEditor(Editor):
         self.doc.print(printer)
 
     def on_text_changed(self, *args):
+        self.changed()
         modified = self.doc.isModified()
         if modified == self.prevModified:
             return
@@ -21,21 +21,52 @@
 #
 
 import os
-from appletree.gui.qt import QTVERSION, Qt, QtCore, loadQImageFix
+import re
+import html
+from hashlib import sha1
+from weakref import ref
+from appletree.gui.qt import QTVERSION, Qt, QtCore
+from appletree.gui.imagecache import decodeImageFile
 from appletree.helpers import T, genuid, messageDialog, getIcon
+from appletree.config import config
+from appletree.backend.base import resourceNameToLocal
 from .rteditorbase import QTextEdit, RTDocument, ImageResizeDialog, ImageViewDialog
-from .editor import Editor, EDITORS
+from .editor import Editor, EDITORS, DOCUMENT_BYTES_PER_CHAR
+from .autosave import getAutosaveScheduler
+
+RE_IMAGE_SRC = re.compile(r'<img\s[^>]*?src\s*=\s*["\']([^"\']*)["\']', re.IGNORECASE)
+
+
+def bodyImages(body):
+    # resource names of images referenced by html body, inline (data:) images excluded
+    if not body:
+        return []
+    return [html.unescape(name) for name in RE_IMAGE_SRC.findall(body) if not name.startswith('data:')]
+
+
+class ImagesSaveStats(object):
+    def __init__(self):
+        self.written = 0
+        self.skipped = 0
+        self.bytes = 0
+
+    def __str__(self):
+        return "images written: {0}, skipped: {1}, bytes: {2}".format(self.written, self.skipped, self.bytes)
 
 
 class RTEditor(Editor):
     prevModified = False
     doc = None
+    imagessaved = None
+    lastsavestats = None
     has_images = True
     can_print = True
     fontselection = None
     fontsizeselection = None
 
     def __init__(self, win, project, docid, docname):
+        # image resources with up to date copy in backend
+        self.imagessaved = set()
         super(RTEditor, self).__init__(win, project, docid, docname)
         self.cursorpos = None
 
@@ -97,55 +128,171 @@ class RTEditor(Editor):
         else:
             draft = True
 
+        self.imagessaved = set()
+        # start decoding document images in background before layout asks for them one by one
+        self.project.doc.prefetchImages(self.docid, bodyImages(docbody))
         self.doc.setHtml(docbody)
         self.setModified(draft)
+        self.draftdirty = False
 
-    def save(self, *args):
-        self.log.info("save()")
-
-        # first getimages, couse this method can change body settings
-        images = self.getImages()
+    def _imagesSnapshot(self, images):
+        # GUI thread: (local names of images saved already, [(resource name, QImage)] to be saved)
         imageslocal = []
-        body = self.getBody()
-        # save images
+        pending = []
+        seen = set()
         for res in images:
             if res.startswith('data:image/'):
                 # ignore inline encoded images
                 continue
+
+            if res in self.doc.remotepending:
+                # only placeholder yet, download still in progress
+                continue
+
+            if res in self.imagessaved:
+                # loaded from backend or saved before, resource did not change since then
+                imageslocal.append(resourceNameToLocal(res, ext='.png'))
+                continue
+
+            if res in seen:
+                continue
+            seen.add(res)
             url = Qt.QUrl()
             url.setUrl(res)
             resobj = self.doc.resource(Qt.QTextDocument.ImageResource, url)
-
-            localname = self.project.doc.putImage(self.docid, res, resobj)
+            if isinstance(resobj, Qt.QPixmap):
+                # QPixmap can not be used outside of GUI thread
+                resobj = resobj.toImage()
+            pending.append((res, resobj))
+        return imageslocal, pending
+
+    def _saveImages(self, imageslocal, pending):
+        # may run on autosave writer thread, no GUI objects or editor state here (see imagesCompletion())
+        imageslocal = list(imageslocal)
+        saved = []
+        stats = ImagesSaveStats()
+        stats.skipped = len(imageslocal)
+        for res, image in pending:
+            localname = self.project.doc.putImage(self.docid, res, image)
             if localname:
                 imageslocal.append(localname)
+                saved.append(res)
+                stats.written += 1
+                stats.bytes += self.project.doc.getImageSize(self.docid, localname) or 0
+
+        return imageslocal, saved, stats
 
-        if self.project.doc.putDocumentBody(self.docid, body):
-            self.setModified(False)
+    def imagesCompletion(self):
+        # GUI thread: resources written by _saveImages() are up to date in backend, unless document was reloaded
+        editor = ref(self)
+        imagessaved = self.imagessaved
 
-        self.project.doc.clearImagesOld(self.docid, imageslocal)
+        def done(saved, stats):
+            editor_ = editor()
+            if editor_ is None or editor_.imagessaved is not imagessaved:
+                return
+            imagessaved.update(saved)
+            editor_.lastsavestats = stats
+        return done
+
+    def extractInlineImages(self):
+        # move data:image/ urls out of document body into named resources (saved to backend like others)
+        if config.debug:
+            self.doc.verifyImages()
+        inline = []
+        cursor = Qt.QTextCursor(self.doc)
+        for position, name in self.doc.images():
+            if name.startswith('data:image/'):
+                # format of character before cursor
+                cursor.setPosition(position + 1)
+                inline.append((position, 1, cursor.charFormat().toImageFormat()))
+
+        if not inline:
+            return 0
+
+        names = dict()
+        cursor = Qt.QTextCursor(self.doc)
+        cursor.beginEditBlock()
+        try:
+            for position, length, imageformat in inline:
+                name = imageformat.name()
+                newname = names.get(name)
+                if newname is None:
+                    image = Qt.QImage()
+                    data = Qt.QByteArray.fromBase64(name.split(",", 1)[-1].encode('ascii'))
+                    if not image.loadFromData(data):
+                        self.log.error("extractInlineImages(): could not decode inline image")
+                        continue
+                    newname = sha1(name.encode('ascii')).hexdigest() + ".png"
+                    self.doc.addResource(Qt.QTextDocument.ImageResource, Qt.QUrl(newname), image)
+                    names[name] = newname
+
+                imageformat.setName(newname)
+                cursor.setPosition(position)
+                cursor.setPosition(position + length, Qt.QTextCursor.KeepAnchor)
+                cursor.setCharFormat(imageformat)
+        finally:
+            cursor.endEditBlock()
 
-    def saveDraft(self):
-        self.log.info("saveDraft()")
+        self.log.info("extractInlineImages(): %s inline images extracted", len(names))
+        return len(names)
 
+    def save(self, *args):
+        """ snapshot of document (body, images) is taken here, images are encoded and written in background """
+        self.log.info("save()")
+
+        self.extractInlineImages()
         # first getimages, couse this method can change body settings
         images = self.getImages()
-        imageslocal = []
         body = self.getBody()
-        # save images
-        for res in images:
-            if res.startswith('data:image/'):
-                # ignore inline encoded images
-                continue
-            url = Qt.QUrl()
-            url.setUrl(res)
-            resobj = self.doc.resource(Qt.QTextDocument.ImageResource, url)
+        imageslocal, pending = self._imagesSnapshot(images)
+        scheduler = getAutosaveScheduler()
+        # drafts queued before are written first and dropped by the save
+        scheduler.remove(self)
+
+        def write():
+            imageslocal_, saved, stats = self._saveImages(imageslocal, pending)
+            self.log.info("save(): %s", stats)
+            if not self.project.doc.putDocumentBody(self.docid, body):
+                return False, saved, stats
+            self.project.doc.clearImagesOld(self.docid, imageslocal_)
+            return True, saved, stats
+
+        imagesdone = self.imagesCompletion()
+        savedone = self.saveCompletion()
+
+        def done(result):
+            if result is None:
+                # write failed
+                savedone(None)
+                return
+            ok, saved, stats = result
+            imagesdone(saved, stats)
+            savedone(ok)
 
-            localname = self.project.doc.putImage(self.docid, res, resobj)
-            if localname:
-                imageslocal.append(localname)
+        scheduler.submit(self, write, done)
 
-        self.project.doc.putDocumentBodyDraft(self.docid, body)
+    def draftSnapshot(self):
+        self.extractInlineImages()
+        # first getimages, couse this method can change body settings
+        images = self.getImages()
+        body = self.getBody()
+        imageslocal, pending = self._imagesSnapshot(images)
+
+        def write():
+            imageslocal_, saved, stats = self._saveImages(imageslocal, pending)
+            self.log.info("draftSnapshot(): %s", stats)
+            self.project.doc.putDocumentBodyDraft(self.docid, body)
+            return saved, stats
+        return write
+
+    def draftCompletion(self):
+        imagesdone = self.imagesCompletion()
+
+        def done(result):
+            if result is not None:
+                imagesdone(*result)
+        return done
 
     def isModified(self):
         return self.doc.isModified()
@@ -159,30 +306,22 @@ class RTEditor(Editor):
     def getBody(self):
         return self.doc.toHtml()
 
+    def memoryEstimate(self):
+        if not self.doc:
+            return 0
+        size = self.doc.characterCount() * DOCUMENT_BYTES_PER_CHAR
+        # decoded images held as document resources
+        for name in set(self.getImages()):
+            image = self.doc.resource(Qt.QTextDocument.ImageResource, Qt.QUrl(name))
+            if isinstance(image, (Qt.QImage, Qt.QPixmap)):
+                size += image.width() * image.height() * image.depth() // 8
+        return size
+
     def getImages(self):
-        images = []
-        block = self.doc.begin()
-        while block.isValid():
-            item = block.begin()
-            while 1:
-                if item.atEnd():
-                    break
-
-                fragment = item.fragment()
-                # shitty C++ iterators ];-S
-                item += 1
-                if not fragment.isValid():
-                    continue
-
-                charformat = fragment.charFormat()
-
-                if charformat.isImageFormat():
-                    imageformat = charformat.toImageFormat()
-                    name = imageformat.name()
-                    images.append(name)
-
-            block = block.next()
-        return images
+        # tracked by RTDocument on contents changes, no document walk
+        if config.debug:
+            self.doc.verifyImages()
+        return list(self.doc.imagenames)
 
     def insertImage(self, path, image=None):
         qurl = Qt.QUrl.fromLocalFile(path)
@@ -190,7 +329,11 @@ class RTEditor(Editor):
         self.log.info("insertImage(): %s: %s", path, url)
 
         if not image:
-            image = loadQImageFix(path)
+            try:
+                image = decodeImageFile(path)
+            except Exception as e:
+                self.log.error("insertImage(): %s: %s: %s", path, e.__class__.__name__, e)
+                return
             if not image:
                 return
 
@@ -238,6 +381,7 @@ class RTEditor(Editor):
         self.doc.print(printer)
 
     def on_text_changed(self, *args):
+        self.changed()
         modified = self.doc.isModified()
         if modified == self.prevModified:
             return
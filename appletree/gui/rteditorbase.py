@@ -22,15 +22,71 @@
 
 from appletree.gui.qt import Qt, QtCore, QtGui, FontDB, loadQImageFix
 from appletree.helpers import T, messageDialog, getIconImage
-import requests
+from appletree.httpcache import HttpCache
+from appletree.gui.imagecache import getImageCache
+from appletree.config import config
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from bisect import bisect_left
 import html
 import re
+import os.path
 import logging
 from weakref import ref
 import base64
 
 RE_URL = re.compile(r'((file|http|ftp|https)://([\w_-]+(?:(?:\.[\w_-]+)+))([\w.,@?^=%&:/~+#-]*[\w@?^=%&/~+#-])?)')
 
+_remoteImageLoader = None
+# resolved images marked for relayout one by one, more are marked as one range
+RELAYOUT_IMAGES_MAX = 8
+
+
+class RemoteImageLoader(Qt.QObject):
+    """ Fetches remote images on worker threads through on-disk HttpCache, result is delivered
+    to GUI thread with loaded signal (url, QImage or None). """
+    loaded = Qt.pyqtSignal(str, object)
+
+    def __init__(self, *args):
+        super(RemoteImageLoader, self).__init__(*args)
+        self.log = logging.getLogger("at.remoteimages")
+        self.cache = HttpCache(os.path.join(config.cache_dir, "http"), config.http_cache_size,
+                               timeout=config.http_timeout, freshness=config.http_cache_freshness)
+        self.pool = ThreadPoolExecutor(max_workers=config.remote_image_workers or 1)
+        self.pending = set()
+        self.lock = Lock()
+
+    def request(self, url):
+        with self.lock:
+            if url in self.pending:
+                return
+            self.pending.add(url)
+        self.pool.submit(self._fetch, url)
+
+    def _fetch(self, url):
+        image = None
+        try:
+            data = self.cache.fetch(url)
+            if data:
+                # QImage (unlike QPixmap) is safe to use outside of GUI thread
+                image = Qt.QImage()
+                if not image.loadFromData(data):
+                    self.log.error("Could not decode remote image: %s", url)
+                    image = None
+        except Exception as e:
+            self.log.error("Failed to retrive remote image: %s: %s: %s", url, e.__class__.__name__, e)
+        finally:
+            with self.lock:
+                self.pending.discard(url)
+        self.loaded.emit(url, image)
+
+
+def getRemoteImageLoader():
+    global _remoteImageLoader
+    if not _remoteImageLoader:
+        _remoteImageLoader = RemoteImageLoader()
+    return _remoteImageLoader
+
 
 class ImageResizeDialog(Qt.QDialog):
     def __init__(self, win, title, name, w, h):
@@ -285,25 +341,162 @@ class RTDocument(Qt.QTextDocument):
         self.log = logging.getLogger("at.document." + docid)
         self.editor = editor
         self.docid = docid
+        self.remotepending = set()
+        self.remoteconnected = False
+        # backend images being decoded in background
+        self.localpending = set()
+        self.localconnected = False
+        self.relayoutpending = False
+        # names of images resolved since last relayout
+        self.relayoutnames = set()
+        # image characters: positions (sorted) and their image names, updated on every contents change
+        self.imagepositions = []
+        self.imagenames = []
+        self.contentsChange.connect(self.on_contents_change)
+        # without layout Qt does not report added characters
+        self.documentLayout()
+
+    def scanImages(self, start, end):
+        """ [(position, image name)] of image characters in start..end """
+        ret = []
+        block = self.findBlock(start)
+        while block.isValid() and block.position() < end:
+            it = block.begin()
+            while not it.atEnd():
+                fragment = it.fragment()
+                it += 1
+                if not fragment.isValid():
+                    continue
+                position = fragment.position()
+                if position >= end:
+                    break
+                charformat = fragment.charFormat()
+                if not charformat.isImageFormat():
+                    continue
+                # adjacent images with the same format are one fragment, one character per image
+                name = charformat.toImageFormat().name()
+                for i in range(max(position, start), min(position + fragment.length(), end)):
+                    ret.append((i, name))
+            block = block.next()
+        return ret
+
+    def images(self):
+        """ [(position, image name)] of all images in the document """
+        return list(zip(self.imagepositions, self.imagenames))
+
+    def verifyImages(self):
+        # full document walk, tracked images are replaced when they differ
+        images = self.scanImages(0, self.characterCount())
+        if images == self.images():
+            return True
+        self.log.error("verifyImages(): tracked images do not match document: %s tracked, %s found",
+                       len(self.imagepositions), len(images))
+        self.imagepositions = [i[0] for i in images]
+        self.imagenames = [i[1] for i in images]
+        return False
+
+    def on_contents_change(self, position, removed, added):
+        positions = self.imagepositions
+        start = bisect_left(positions, position)
+        end = bisect_left(positions, position + removed)
+        # range may reach past the end (final paragraph separator)
+        images = self.scanImages(position, min(position + added, self.characterCount()))
+        shift = added - removed
+        if start == end and not images and (not shift or end == len(positions)):
+            return
+        self.imagepositions = positions[:start] + [i[0] for i in images] + [p + shift for p in positions[end:]]
+        self.imagenames = self.imagenames[:start] + [i[1] for i in images] + self.imagenames[end:]
 
-    def loadResourceRemote(self, url):
-        # TODO: show wait/progress dialog/info
+    def loadResourceRemote(self, _qurl):
+        # show placeholder now, real image is added when download completes
+        url = _qurl.toString()
+        image = getIconImage("noimage")
+        self.addResource(Qt.QTextDocument.ImageResource, _qurl, image)
+        if url not in self.remotepending:
+            self.remotepending.add(url)
+            loader = getRemoteImageLoader()
+            if not self.remoteconnected:
+                loader.loaded.connect(self.on_remote_image_loaded)
+                self.remoteconnected = True
+            loader.request(url)
+        return image
+
+    def on_remote_image_loaded(self, url, image):
+        if url not in self.remotepending:
+            return
+        self.remotepending.discard(url)
+        if image is None:
+            # keep placeholder, but never store it as document image
+            self.editor.imagessaved.add(url)
+            return
+
+        self.addResource(Qt.QTextDocument.ImageResource, Qt.QUrl(url), image)
+        self.relayout(url)
+
+    def loadResourceLocal(self, _qurl):
+        # backend image is decoded in background, placeholder is shown until on_image_decoded()
+        url = _qurl.toString()
+        image = getIconImage("noimage")
+        self.addResource(Qt.QTextDocument.ImageResource, _qurl, image)
+        # stored in backend already, placeholder is never saved
+        self.editor.imagessaved.add(url)
+        self.localpending.add(url)
+        if not self.localconnected:
+            getImageCache().decoded.connect(self.on_image_decoded)
+            self.localconnected = True
+        return image
+
+    def on_image_decoded(self, tag, image):
+        projectid, docid, url = tag
+        if docid != self.docid or url not in self.localpending or projectid != self.editor.project.projectid:
+            return
+        self.localpending.discard(url)
+        if image is None:
+            # keep placeholder
+            return
+        self.addResource(Qt.QTextDocument.ImageResource, Qt.QUrl(url), Qt.QPixmap.fromImage(image))
+        self.relayout(url)
+
+    def relayout(self, name):
+        # images delivered together are laid out once
+        self.relayoutnames.add(name)
+        if not self.relayoutpending:
+            self.relayoutpending = True
+            Qt.QTimer.singleShot(0, self.on_relayout)
+
+    def on_relayout(self):
         try:
-            ret = requests.get(url)
-            if ret.status_code not in (200,):
-                return None
-
-            data = Qt.QByteArray(ret.content)
-            image = Qt.QPixmap()
-            image.loadFromData(data)
-            data.clear()
-            return image
-        except Exception as e:
-            self.log.error("Failed to retrive remote image: %s: %s", e.__class__.__name__, e)
+            self.relayoutpending = False
+            names = self.relayoutnames
+            self.relayoutnames = set()
+            # relayout image characters with new images sizes, it is not a document change
+            modified = self.isModified()
+            found = set()
+            positions = []
+            for position, name in zip(self.imagepositions, self.imagenames):
+                if name in names:
+                    found.add(name)
+                    positions.append(position)
+            if len(found) < len(names):
+                # not tracked under resource name
+                self.markContentsDirty(0, self.characterCount())
+            elif len(positions) <= RELAYOUT_IMAGES_MAX:
+                for position in positions:
+                    self.markContentsDirty(position, 1)
+            elif positions:
+                # every mark repositions the rest of the document, many images are laid out as one range
+                self.markContentsDirty(positions[0], positions[-1] - positions[0] + 1)
+            if self.isModified() != modified:
+                self.editor.setModified(modified)
+        except RuntimeError:
+            # document deleted in the meantime
+            pass
 
     def loadResourceMissing(self, _qurl):
         image = getIconImage("noimage")
         self.editor.doc.addResource(Qt.QTextDocument.ImageResource, _qurl, image)
+        # never store placeholder as document image
+        self.editor.imagessaved.add(_qurl.toString())
         return image
 
     def loadResource(self, p_int, _qurl):
@@ -313,19 +506,20 @@ class RTDocument(Qt.QTextDocument):
 
         self.editor.log.info("loadResource(): %s", url)
         scheme = _qurl.scheme()
-        image = self.editor.project.doc.getImage(self.docid, url)
+        tag = (self.editor.project.projectid, self.docid, url)
+        image, pending = self.editor.project.doc.requestImage(self.docid, url, tag)
         if image:
             self.editor.doc.addResource(Qt.QTextDocument.ImageResource, _qurl, image)
+            self.editor.imagessaved.add(url)
             return image
+        if pending:
+            return self.loadResourceLocal(_qurl)
 
         if scheme:
             if scheme in ('http', 'https'):
                 self.editor.log.info("Trying retrive remote image: %s", url)
                 # remote image get it from network
-                image = self.loadResourceRemote(url)
-                if image:
-                    self.editor.doc.addResource(Qt.QTextDocument.ImageResource, _qurl, image)
-                return image
+                return self.loadResourceRemote(_qurl)
 
             if scheme == 'file':
                 try:
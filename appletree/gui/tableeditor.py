@@ -89,6 +89,7 @@ class TableEditor(Editor):
             self.model.appendRow(items)
 
     def on_item_changed(self, item):
+        self.changed()
         self.setModified(True)
 
     def on_toolbar_editor_action(self, name):
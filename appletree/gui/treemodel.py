@@ -0,0 +1,413 @@
+#!/usr/bin/env python3
+#
+#       Copyright 2017+ Jakub Kolasa <jkolczasty@gmail.com>
+#
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 3 of the License, or
+#       (at your option) any later version.
+#
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+#
+# __author__ = 'Jakub Kolasa <jkolczasty@gmail.com'>
+#
+
+# Documents tree model for QATTreeView. Nodes are light python objects created from the parsed doctree (DocTree)
+# one level at a time: a node keeps its DocTree index (pending) until its children are needed, and shows them
+# to the view only after fetchMore() (on expand).
+# Nodes mimic the QTreeWidgetItem API used by ProjectView, so both tree widgets can be driven the same way.
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+from weakref import ref
+from appletree.gui.qt import Qt, QtCore
+from appletree.gui.consts import TREE_ITEM_FLAGS, TREE_COLUMN_NAME, TREE_COLUMN_UID, TREE_COLUMN_COUNT
+
+MIME_TYPE = "application/x-appletree-docids"
+
+
+class DocumentsTreeNode(object):
+    __slots__ = ('columns', 'icon', 'children', 'fetched', 'expanded', 'pending', '_parent', '_row', '_model',
+                 '__weakref__')
+
+    def __init__(self, parent=None, columns=None, model=None):
+        self.columns = list(columns or ()) + [None] * (TREE_COLUMN_COUNT - len(columns or ()))
+        self.icon = None
+        self.children = []
+        # number of children exposed to the view
+        self.fetched = 0
+        self.expanded = False
+        # DocTree index of node with children not created yet (-1: top level), None: children created
+        self.pending = None
+        self._parent = None
+        self._row = 0
+        self._model = model
+        if parent is not None:
+            parent.addChild(self)
+
+    def model(self):
+        return self._model() if self._model else None
+
+    def text(self, column):
+        return self.columns[column] or ""
+
+    def setText(self, column, value):
+        if self.columns[column] == value:
+            return
+        self.columns[column] = value
+        model = self.model()
+        if model:
+            model.nodeChanged(self, column)
+
+    def setIcon(self, column, icon):
+        self.icon = icon
+
+    def setFlags(self, flags):
+        # flags are common for all nodes, see DocumentsTreeModel.flags()
+        pass
+
+    def setExpanded(self, expanded):
+        self.expanded = expanded
+        model = self.model()
+        if model:
+            model.nodeExpanded(self)
+
+    def isExpanded(self):
+        return self.expanded
+
+    def parent(self):
+        # like QTreeWidgetItem: top level items have no parent
+        if self._parent is None or self._parent._parent is None:
+            return None
+        return self._parent
+
+    def buildChildren(self):
+        if self.pending is None:
+            return
+        model = self.model()
+        if model:
+            model.buildChildren(self)
+        else:
+            self.pending = None
+
+    def childCount(self):
+        self.buildChildren()
+        return len(self.children)
+
+    def child(self, index):
+        self.buildChildren()
+        if 0 <= index < len(self.children):
+            return self.children[index]
+        return None
+
+    def row(self):
+        siblings = self._parent.children if self._parent is not None else ()
+        # cached row is validated, recomputed only after siblings were inserted/removed
+        if self._row < len(siblings) and siblings[self._row] is self:
+            return self._row
+        try:
+            self._row = siblings.index(self)
+        except ValueError:
+            self._row = -1
+        return self._row
+
+    def indexOfChild(self, child):
+        if child is None or child._parent is not self:
+            return -1
+        return child.row()
+
+    def isAncestorOf(self, node):
+        while node is not None:
+            if node is self:
+                return True
+            node = node._parent
+        return False
+
+    def addChild(self, child):
+        self.buildChildren()
+        self.insertChild(len(self.children), child)
+
+    def addChildren(self, children):
+        self.buildChildren()
+        model = self.model()
+        if model:
+            model.insertNodes(self, len(self.children), children)
+        else:
+            for child in children:
+                self.insertChild(len(self.children), child)
+
+    def insertChild(self, index, child):
+        self.buildChildren()
+        model = self.model()
+        if model:
+            model.insertNode(self, index, child)
+        else:
+            child._parent = self
+            child._row = index
+            self.children.insert(index, child)
+
+    def takeChild(self, index):
+        self.buildChildren()
+        if not 0 <= index < len(self.children):
+            return None
+        model = self.model()
+        if model:
+            return model.takeNode(self, index)
+        child = self.children.pop(index)
+        child._parent = None
+        return child
+
+    def takeChildren(self):
+        self.buildChildren()
+        ret = []
+        while self.children:
+            ret.append(self.takeChild(len(self.children) - 1))
+        ret.reverse()
+        return ret
+
+
+class DocumentsTreeModel(Qt.QAbstractItemModel):
+    # node, column
+    nodeDataChanged = Qt.pyqtSignal(object, int)
+    # node requested to be expanded
+    nodeExpandRequested = Qt.pyqtSignal(object)
+
+    def __init__(self, parent=None):
+        super(DocumentsTreeModel, self).__init__(parent)
+        self.root = DocumentsTreeNode(model=ref(self))
+        # while loading nodes are attached silently, view is reset once at the end
+        self.loading = 0
+        # parsed doctree (DocTree) nodes are created from, and factory(docid, name) -> detached node
+        self.source = None
+        self.factory = None
+
+    def newNode(self, parent, columns):
+        # parent None: detached node, to be attached later with addChild()/addChildren()
+        return DocumentsTreeNode(parent, columns, model=ref(self))
+
+    def beginLoad(self):
+        if not self.loading:
+            self.beginResetModel()
+        self.loading += 1
+
+    def endLoad(self):
+        self.loading -= 1
+        if not self.loading:
+            self.endResetModel()
+
+    def setSource(self, doctree, factory):
+        """ reset model to doctree (DocTree), top level nodes are created now, deeper levels on demand """
+        self.beginResetModel()
+        self.source = doctree
+        self.factory = factory
+        root = self.root
+        for child in root.children:
+            child._parent = None
+        root.children = []
+        root.fetched = 0
+        root.pending = -1
+        self.buildChildren(root)
+        self.endResetModel()
+
+    def _firstSourceChild(self, i):
+        if i < 0:
+            return 0 if len(self.source) else -1
+        return self.source.firstchild[i]
+
+    def buildChildren(self, node):
+        """ create pending node children from source, they are exposed to the view by fetchMore() """
+        i = node.pending
+        node.pending = None
+        if i is None or self.source is None:
+            return
+        source = self.source
+        children = []
+        # nodes are created silently, not attached yet
+        self.loading += 1
+        try:
+            c = self._firstSourceChild(i)
+            while c >= 0:
+                child = self.factory(source.ids[c], source.names[c])
+                child.pending = c
+                children.append(child)
+                c = source.nextsibling[c]
+        finally:
+            self.loading -= 1
+        for row, child in enumerate(children):
+            child._model = node._model
+            child._parent = node
+            child._row = row
+        # pending node has no children, inserts build children first
+        node.children = children
+
+    def _node(self, index):
+        if not index.isValid():
+            return self.root
+        return index.internalPointer()
+
+    def isExposed(self, node):
+        # node has valid QModelIndex, when all its ancestors fetched it
+        while node is not self.root:
+            parent = node._parent
+            if parent is None or node.row() >= parent.fetched:
+                return False
+            node = parent
+        return True
+
+    def indexOfNode(self, node, column=0):
+        if node is None or node is self.root or not self.isExposed(node):
+            return QtCore.QModelIndex()
+        return self.createIndex(node.row(), column, node)
+
+    def insertNode(self, parent, index, child):
+        self.insertNodes(parent, index, [child])
+
+    def insertNodes(self, parent, index, children):
+        if not children:
+            return
+        if parent.pending is not None:
+            self.buildChildren(parent)
+        for i, child in enumerate(children):
+            child._model = parent._model
+            child._parent = parent
+            child._row = index + i
+        if not self.loading and index <= parent.fetched and self.isExposed(parent):
+            self.beginInsertRows(self.indexOfNode(parent), index, index + len(children) - 1)
+            parent.children[index:index] = children
+            parent.fetched += len(children)
+            self.endInsertRows()
+        else:
+            # not exposed yet, fetchMore() will show it
+            parent.children[index:index] = children
+
+    def takeNode(self, parent, index):
+        if not self.loading and index < parent.fetched and self.isExposed(parent):
+            self.beginRemoveRows(self.indexOfNode(parent), index, index)
+            child = parent.children.pop(index)
+            parent.fetched -= 1
+            self.endRemoveRows()
+        else:
+            child = parent.children.pop(index)
+            if index < parent.fetched:
+                parent.fetched -= 1
+        child._parent = None
+        return child
+
+    def moveNode(self, node, parent, index):
+        # plain take+insert, nodes (and their subtrees) are preserved
+        oldparent = node._parent
+        oldindex = node.row()
+        if oldparent is parent and oldindex < index:
+            index -= 1
+        self.takeNode(oldparent, oldindex)
+        self.insertNode(parent, index, node)
+
+    def nodeChanged(self, node, column):
+        if self.loading:
+            return
+        index = self.indexOfNode(node, column)
+        if index.isValid():
+            self.dataChanged.emit(index, index)
+        self.nodeDataChanged.emit(node, column)
+
+    def nodeExpanded(self, node):
+        if not self.loading and node.expanded:
+            self.nodeExpandRequested.emit(node)
+
+    # QAbstractItemModel API
+
+    def index(self, row, column, parent=QtCore.QModelIndex()):
+        node = self._node(parent)
+        if row < 0 or row >= node.fetched or column < 0 or column >= TREE_COLUMN_COUNT:
+            return QtCore.QModelIndex()
+        return self.createIndex(row, column, node.children[row])
+
+    def parent(self, index):
+        if not index.isValid():
+            return QtCore.QModelIndex()
+        parent = index.internalPointer()._parent
+        if parent is None or parent is self.root:
+            return QtCore.QModelIndex()
+        return self.createIndex(parent.row(), 0, parent)
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.column() > 0:
+            return 0
+        return self._node(parent).fetched
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        return TREE_COLUMN_COUNT
+
+    def hasChildren(self, parent=QtCore.QModelIndex()):
+        if parent.column() > 0:
+            return False
+        node = self._node(parent)
+        if node.pending is not None:
+            return self._firstSourceChild(node.pending) >= 0
+        return len(node.children) > 0
+
+    def canFetchMore(self, parent):
+        node = self._node(parent)
+        if node.pending is not None:
+            return self._firstSourceChild(node.pending) >= 0
+        return node.fetched < len(node.children)
+
+    def fetchMore(self, parent):
+        node = self._node(parent)
+        if node.pending is not None:
+            self.buildChildren(node)
+        count = len(node.children)
+        if node.fetched >= count:
+            return
+        self.beginInsertRows(parent, node.fetched, count - 1)
+        node.fetched = count
+        self.endInsertRows()
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        node = index.internalPointer()
+        if role in (QtCore.Qt.DisplayRole, QtCore.Qt.EditRole):
+            return node.columns[index.column()]
+        if role == QtCore.Qt.DecorationRole and index.column() == TREE_COLUMN_NAME:
+            return node.icon
+        return None
+
+    def setData(self, index, value, role=QtCore.Qt.EditRole):
+        if not index.isValid() or role != QtCore.Qt.EditRole:
+            return False
+        index.internalPointer().setText(index.column(), value)
+        return True
+
+    def flags(self, index):
+        if not index.isValid():
+            return QtCore.Qt.ItemIsDropEnabled
+        if index.column() != TREE_COLUMN_NAME:
+            return TREE_ITEM_FLAGS & ~QtCore.Qt.ItemIsEditable
+        return TREE_ITEM_FLAGS
+
+    def supportedDropActions(self):
+        return QtCore.Qt.MoveAction
+
+    def mimeTypes(self):
+        return [MIME_TYPE]
+
+    def mimeData(self, indexes):
+        # moves are done by QATTreeView.dropEvent on selected nodes, payload is informational only
+        nodes = []
+        for index in indexes:
+            node = index.internalPointer()
+            if node not in nodes:
+                nodes.append(node)
+        data = QtCore.QMimeData()
+        data.setData(MIME_TYPE, Qt.QByteArray(",".join(node.text(TREE_COLUMN_UID) for node in nodes).encode('utf-8')))
+        return data
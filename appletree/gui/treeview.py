@@ -21,23 +21,67 @@
 #
 
 from weakref import ref
-from appletree.gui.qt import Qt
+from appletree.config import config
+from appletree.gui.qt import Qt, QtCore
+from appletree.gui.treemodel import DocumentsTreeModel
 from appletree.gui.utils import ObjectCallbackWrapperRef, MakeQAction
-from appletree.helpers import T
+from appletree.helpers import T, getTagPixmap
 
-from appletree.gui.consts import TREE_COLUMN_UID, TREE_COLUMN_NAME, TAGS_NAMES
+from appletree.gui.consts import TREE_COLUMN_UID, TREE_COLUMN_NAME, TREE_COLUMN_TAGS, TAGS_NAMES
 
 _CLONE_ITEM = None
 
 
-class QATTreeWidget(Qt.QTreeWidget):
-    menu = None
+class TagsItemDelegate(Qt.QStyledItemDelegate):
+    """ Paints tags icons (from TREE_COLUMN_TAGS text of the row) right aligned in the cell. """
+    margin = 1
+    spacing = 1
+
+    def _tagsPixmaps(self, index, height):
+        tags = index.sibling(index.row(), TREE_COLUMN_TAGS).data() or ""
+        ret = []
+        for tag in tags.split(","):
+            if not tag:
+                continue
+            pixmap = getTagPixmap(tag, height)
+            if pixmap and not pixmap.isNull():
+                ret.append(pixmap)
+        return ret
+
+    def paint(self, painter, option, index):
+        super(TagsItemDelegate, self).paint(painter, option, index)
+        rect = option.rect
+        h = rect.height() - 2 * self.margin
+        if h < 1:
+            return
+        pixmaps = self._tagsPixmaps(index, h)
+        if not pixmaps:
+            return
+
+        w = sum(pixmap.width() for pixmap in pixmaps) + self.spacing * (len(pixmaps) - 1)
+        x = rect.right() - self.margin - w + 1
+        y = rect.top() + self.margin
+        for pixmap in pixmaps:
+            painter.drawPixmap(x, y, pixmap)
+            x += pixmap.width() + self.spacing
+
+    def sizeHint(self, option, index):
+        size = super(TagsItemDelegate, self).sizeHint(option, index)
+        h = size.height() - 2 * self.margin
+        if h < 1:
+            return size
+        pixmaps = self._tagsPixmaps(index, h)
+        if pixmaps:
+            w = sum(pixmap.width() for pixmap in pixmaps) + self.spacing * (len(pixmaps) - 1) + 2 * self.margin
+            size.setWidth(max(size.width(), w))
+        return size
 
-    def __init__(self, win, parent=None):
-        super(QATTreeWidget, self).__init__(parent)
-        self.setAcceptDrops(True)
-        self.win = ref(win)
 
+class TreeContextMenuMixin(object):
+    """ Documents context menu, common for QATTreeWidget and QATTreeView """
+    menu = None
+
+    def buildContextMenu(self):
         self.menu = Qt.QMenu()
         i = 0
         for tag in TAGS_NAMES:
@@ -58,19 +102,6 @@ class QATTreeWidget(Qt.QTreeWidget):
         action.triggered.connect(self.on_contextmenu_remove)
         self.menu.addAction(action)
 
-    def dropEvent(self, event):
-        win = self.win()
-        if not win:
-            return
-
-        # return if action changed or should be passwd to inherited method
-        if win.on_tree_drop_event(event):
-            return
-
-        ret = super(QATTreeWidget, self).dropEvent(event)
-        win.on_tree_drop_after_event()
-        return ret
-
     def contextMenuEvent(self, event):
         global _CLONE_ITEM
 
@@ -136,3 +167,206 @@ class QATTreeWidget(Qt.QTreeWidget):
             return
         item = items[0]
         win.tagDocuemntTree(treeitem=item, toggletags=[tag, ])
+
+
+class QATTreeWidget(TreeContextMenuMixin, Qt.QTreeWidget):
+    def __init__(self, win, parent=None):
+        super(QATTreeWidget, self).__init__(parent)
+        self.setAcceptDrops(True)
+        self.win = ref(win)
+        self.buildContextMenu()
+
+    def newItem(self, parent, columns):
+        if parent is None:
+            return Qt.QTreeWidgetItem(columns)
+        return Qt.QTreeWidgetItem(parent, columns)
+
+    def beginLoad(self):
+        self.setUpdatesEnabled(False)
+
+    def endLoad(self):
+        self.setUpdatesEnabled(True)
+
+    def dropEvent(self, event):
+        win = self.win()
+        if not win:
+            return
+
+        # return if action changed or should be passwd to inherited method
+        if win.on_tree_drop_event(event):
+            return
+
+        ret = super(QATTreeWidget, self).dropEvent(event)
+        win.on_tree_drop_after_event()
+        return ret
+
+
+class QATTreeView(TreeContextMenuMixin, Qt.QTreeView):
+    """ QTreeView over DocumentsTreeModel with (subset of) QTreeWidget API used by ProjectView """
+    itemChanged = Qt.pyqtSignal(object)
+    itemSelectionChanged = Qt.pyqtSignal()
+
+    def __init__(self, win, parent=None):
+        super(QATTreeView, self).__init__(parent)
+        self.setAcceptDrops(True)
+        self.win = ref(win)
+        self.buildContextMenu()
+
+        self._model = DocumentsTreeModel(self)
+        self.setModel(self._model)
+        self.setUniformRowHeights(True)
+        self.setSelectionMode(Qt.QAbstractItemView.SingleSelection)
+        self._model.nodeDataChanged.connect(self.on_node_data_changed)
+        self._model.nodeExpandRequested.connect(self.on_node_expand_requested)
+        self._model.modelReset.connect(self.on_model_reset)
+        self.selectionModel().selectionChanged.connect(self.on_selection_changed)
+        self.expanded.connect(self.on_expanded)
+        self.collapsed.connect(self.on_collapsed)
+
+    def setColumnCount(self, count):
+        # columns are defined by the model
+        pass
+
+    def newItem(self, parent, columns):
+        return self._model.newNode(parent, columns)
+
+    def invisibleRootItem(self):
+        return self._model.root
+
+    def addTopLevelItems(self, items):
+        self._model.root.addChildren(items)
+
+    def itemFromIndex(self, index):
+        if not index.isValid():
+            return None
+        return index.internalPointer()
+
+    def indexFromItem(self, item, column=0):
+        return self._model.indexOfNode(item, column)
+
+    def currentItem(self):
+        return self.itemFromIndex(self.currentIndex())
+
+    def selectedItems(self):
+        ret = []
+        for index in self.selectionModel().selectedRows(TREE_COLUMN_NAME):
+            ret.append(index.internalPointer())
+        return ret
+
+    def exposeItem(self, item):
+        # fetch all ancestors, so item gets valid index
+        path = []
+        node = item._parent
+        while node is not None and node is not self._model.root:
+            path.append(node)
+            node = node._parent
+        for node in reversed(path):
+            index = self._model.indexOfNode(node)
+            self._model.fetchMore(index)
+            self.expand(index)
+
+    def setCurrentItem(self, item):
+        if not self._model.isExposed(item):
+            self.exposeItem(item)
+        index = self._model.indexOfNode(item)
+        if index.isValid():
+            self.setCurrentIndex(index)
+
+    def beginLoad(self):
+        self._model.beginLoad()
+
+    def endLoad(self):
+        self._model.endLoad()
+
+    def setSource(self, doctree, factory):
+        self._model.setSource(doctree, factory)
+
+    def restoreExpanded(self, limit=None):
+        """ expand nodes marked as expanded (breadth first) until about limit rows are shown """
+        root = self._model.root
+        self._model.fetchMore(QtCore.QModelIndex())
+        shown = root.fetched
+        queue = [root]
+        while queue:
+            nodes = queue
+            queue = []
+            for node in nodes:
+                for child in node.children[:node.fetched]:
+                    if not child.expanded:
+                        continue
+                    count = child.childCount()
+                    if not count:
+                        continue
+                    if limit is not None and shown + count > limit:
+                        return
+                    index = self._model.indexOfNode(child)
+                    self._model.fetchMore(index)
+                    self.expand(index)
+                    shown += child.fetched
+                    queue.append(child)
+
+    def dropEvent(self, event):
+        win = self.win()
+        if not win:
+            return
+
+        if win.on_tree_drop_event(event):
+            return
+
+        nodes = self.selectedItems()
+        target = self.itemFromIndex(self.indexAt(event.pos()))
+        position = self.dropIndicatorPosition()
+        if target is None or position == Qt.QAbstractItemView.OnViewport:
+            parent = self._model.root
+            row = parent.childCount()
+        elif position == Qt.QAbstractItemView.OnItem:
+            parent = target
+            row = parent.childCount()
+        else:
+            parent = target._parent
+            row = target.row()
+            if position == Qt.QAbstractItemView.BelowItem:
+                row += 1
+
+        nodes = [node for node in nodes if not node.isAncestorOf(parent)]
+        if not nodes:
+            event.ignore()
+            return
+
+        for node in nodes:
+            self._model.moveNode(node, parent, row)
+            row = node.row() + 1
+
+        if parent is not self._model.root:
+            parent.expanded = True
+            self.exposeItem(nodes[0])
+        self.setCurrentItem(nodes[0])
+
+        # the move is done here, CopyAction keeps the view from removing source rows
+        event.setDropAction(QtCore.Qt.CopyAction)
+        event.accept()
+        win.on_tree_drop_after_event()
+
+    def on_selection_changed(self, *args):
+        self.itemSelectionChanged.emit()
+
+    def on_node_data_changed(self, node, column):
+        self.itemChanged.emit(node)
+
+    def on_node_expand_requested(self, node):
+        index = self._model.indexOfNode(node)
+        if index.isValid():
+            self.expand(index)
+
+    def on_model_reset(self):
+        self.restoreExpanded(config.tree_expand_rows)
+
+    def on_expanded(self, index):
+        node = self.itemFromIndex(index)
+        if node:
+            node.expanded = True
+
+    def on_collapsed(self, index):
+        node = self.itemFromIndex(index)
+        if node:
+            node.expanded = False
@@ -23,7 +23,7 @@
 from uuid import uuid4
 import os.path
 
-from appletree.gui.qt import Qt
+from appletree.gui.qt import Qt, QtCore
 from appletree.gui.consts import TAGS_NAMES
 from appletree.config import config
 
@@ -37,28 +37,65 @@ def genuid():
     return str(uuid4())
 
 
+# rendered icons/pixmaps cache, keys: name or (name, height)
+_icons = dict()
+_pixmaps = dict()
+_images = dict()
+
+
 def getIcon(name):
+    icon = _icons.get(name)
+    if icon is not None:
+        return icon
+
     bfn = os.path.join(config.base_dir, "icons", name)
     fn = bfn + ".svg"
-    if os.path.isfile(fn):
-        return Qt.QIcon(fn)
+    if not os.path.isfile(fn):
         fn = bfn + ".png"
-    return Qt.QIcon(fn)
+    icon = Qt.QIcon(fn)
+    _icons[name] = icon
+    return icon
 
 
 def getIconImage(name):
+    image = _images.get(name)
+    if image is not None:
+        return image
     fn = os.path.join("icons", name + ".png")
-    return Qt.QImage(fn)
+    image = _images[name] = Qt.QImage(fn)
+    return image
 
 
-def getIconPixmap(name):
+def getIconPixmap(name, height=None):
+    key = (name, height)
+    pixmap = _pixmaps.get(key)
+    if pixmap is not None:
+        return pixmap
+
     bfn = os.path.join(config.base_dir, "icons", name)
     fn = bfn + ".svg"
-    if os.path.isfile(fn):
-        return Qt.QPixmap(fn, "SVG")
+    svg = os.path.isfile(fn)
+    if not height:
+        if svg:
+            pixmap = Qt.QPixmap(fn, "SVG")
+        else:
+            pixmap = Qt.QPixmap(bfn + ".png", "PNG")
+    else:
+        pixmap = getIconPixmap(name)
+        if not pixmap.isNull():
+            if svg:
+                # rasterise svg directly in requested size
+                width = max(1, int(round(pixmap.width() * height / float(pixmap.height()))))
+                pixmap = getIcon(name).pixmap(width, height)
+            else:
+                pixmap = pixmap.scaledToHeight(height, QtCore.Qt.SmoothTransformation)
 
-    fn = bfn + ".png"
-    return Qt.QPixmap(fn, "PNG")
+    _pixmaps[key] = pixmap
+    return pixmap
+
+
+def getTagPixmap(tag, height):
+    return getIconPixmap("icon-tag-{0}".format(tag), height)
 
 
 def messageDialog(title, message, details=None, OkCancel=False, icon=None):
@@ -87,61 +124,66 @@ def tagsSortKey(item):
         return 9999
 
 
-def _processDocumentsTreeMeta(project, docid, docname, items, parent, meta, callback):
-    callback(project, docid, docname, parent, meta)
-
-    for childdocid, childdocname, childitems in items:
-        childmeta = project.doc.getDocumentMeta(childdocid)
-        _processDocumentsTreeMeta(project, childdocid, childdocname, childitems, docid, childmeta, callback)
-
-
-def processProjectDocumentsTreeMeta(project, callback):
-    backend = project.doc
-    doctree = backend.getDocumentsTree()
-
-    if not doctree:
+def walkDocumentsTree(doctree, order='pre', parent=None, depth=0):
+    """ iterate doctree ([(docid, name, items), ...]) without recursion, yields (docid, name, parent, depth);
+    order 'pre': parents before children, 'post': children before parents """
+    if order not in ('pre', 'post'):
+        raise ValueError("order: " + str(order))
+    post = order == 'post'
+    # iterators keep sibling order, stack grows with depth only
+    stack = [(iter(doctree), parent, depth, None)]
+    while stack:
+        items, parent, depth, owner = stack[-1]
+        for docid, docname, children in items:
+            node = (docid, docname, parent, depth)
+            if not post:
+                yield node
+            if children:
+                stack.append((iter(children), docid, depth + 1, node))
+                break
+            if post:
+                yield node
+        else:
+            stack.pop()
+            if post and owner is not None:
+                yield owner
+
+
+def iterDocumentsTree(project, order='pre', with_meta=False):
+    """ yields (docid, name, parent, depth) for project documents, (docid, name, parent, depth, meta)
+    if with_meta (metas are read in bulk before the walk) """
+    doctree = project.docTree()
+    if not with_meta:
+        for node in doctree.walk(order):
+            yield node
         return
-    for docid, docname, items in doctree:
-        meta = project.doc.getDocumentMeta(docid)
-        _processDocumentsTreeMeta(project, docid, docname, items, None, meta, callback)
 
+    metas = project.doc.getDocumentsMetaBulk(doctree.ids)
+    for docid, docname, parent, depth in doctree.walk(order):
+        yield docid, docname, parent, depth, metas.get(docid)
 
-def _processDocumentsTree(project, docid, docname, items, parent, callback):
-    callback(project, docid, docname, parent)
 
-    for childdocid, childdocname, childitems in items:
-        _processDocumentsTree(project, childdocid, childdocname, childitems, docid, callback)
+def processProjectDocumentsTreeMeta(project, callback):
+    for docid, docname, parent, depth, meta in iterDocumentsTree(project, with_meta=True):
+        callback(project, docid, docname, parent, meta)
 
 
 def processProjectDocumentsTree(project, callback):
-    backend = project.doc
-    doctree = backend.getDocumentsTree()
-
-    if not doctree:
-        return
-    for docid, docname, items in doctree:
-        _processDocumentsTree(project, docid, docname, items, None, callback)
-
-
-def _countProjectDocumentsTree(project, docid, docname, parent):
-    project.documentsCount += 1
+    for docid, docname, parent, depth in iterDocumentsTree(project):
+        callback(project, docid, docname, parent)
 
 
 def countProjectDocumentsTree(project):
-    project.documentsCount = 0
-    processProjectDocumentsTree(project, _countProjectDocumentsTree)
-    ret = project.documentsCount
-    del project.documentsCount
-    return ret
+    count = project.doc.countDocuments()
+    if count is not None:
+        return count
 
-
-def _listProjectDocumentsTree(project, docid, docname, parent):
-    project.documentsList.append(docid)
+    return len(project.docTree())
 
 
 def listProjectDocumentsTree(project):
-    project.documentsList = []
-    processProjectDocumentsTree(project, _listProjectDocumentsTree)
-    ret = project.documentsList
-    del project.documentsList
-    return ret
+    documents = project.doc.listDocuments()
+    if documents is not None:
+        return documents
+
+    return list(project.docTree().ids)
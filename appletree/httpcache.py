@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+#
+#       Copyright 2017+ Jakub Kolasa <jkolczasty@gmail.com>
+#
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 3 of the License, or
+#       (at your option) any later version.
+#
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+#
+# __author__ = 'Jakub Kolasa <jkolczasty@gmail.com'>
+#
+
+# On-disk HTTP cache for remote resources (no Qt here, usable from worker threads).
+# Entries are served without a request while fresh (Cache-Control max-age / Expires, or default freshness when
+# server sends neither), then revalidated with ETag / Last-Modified. Evicted least recently used first.
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+import os
+import time
+import json
+import logging
+from email.utils import parsedate_to_datetime
+from hashlib import sha1
+from threading import Lock
+
+import requests
+
+from appletree.backend.base import atomicWrite, DURABILITY_NONE
+
+
+def freshUntil(headers, now, default=0):
+    """ timestamp until response can be used without revalidation """
+    directives = dict()
+    for directive in (headers.get('Cache-Control') or "").lower().split(","):
+        name, sep, value = directive.strip().partition("=")
+        directives[name] = value.strip('"')
+
+    if 'no-cache' in directives or 'no-store' in directives:
+        return now
+    if 'max-age' in directives:
+        try:
+            return now + int(directives['max-age'])
+        except ValueError:
+            return now
+
+    expires = headers.get('Expires')
+    if expires:
+        try:
+            return parsedate_to_datetime(expires).timestamp()
+        except (TypeError, ValueError):
+            # invalid date means already expired
+            return now
+    return now + default
+
+
+class HttpCache(object):
+    def __init__(self, path, maxsize, timeout=10, freshness=0):
+        self.log = logging.getLogger("at.httpcache")
+        self.path = path
+        self.maxsize = maxsize
+        self.timeout = timeout
+        # seconds entry is fresh when server sends no Cache-Control/Expires
+        self.freshness = freshness
+        self.lock = Lock()
+        self.size = None
+
+    def _entryPath(self, url):
+        return os.path.join(self.path, sha1(url.encode('utf-8')).hexdigest())
+
+    def _entries(self):
+        ret = []
+        for fn in os.listdir(self.path):
+            if not fn.endswith(".data"):
+                continue
+            try:
+                st = os.stat(os.path.join(self.path, fn))
+            except OSError:
+                continue
+            ret.append((st.st_mtime, st.st_size, fn[:-5]))
+        return ret
+
+    def get(self, url):
+        base = self._entryPath(url)
+        try:
+            with open(base + ".meta", 'r') as f:
+                meta = json.loads(f.read())
+            with open(base + ".data", 'rb') as f:
+                data = f.read()
+            # mtime is LRU clock
+            os.utime(base + ".data", None)
+            return data, meta
+        except FileNotFoundError:
+            return None, None
+        except Exception as e:
+            self.log.error("get(): %s: %s: %s", url, e.__class__.__name__, e)
+            return None, None
+
+    def put(self, url, data, etag=None, lastmodified=None, expires=0):
+        base = self._entryPath(url)
+        meta = dict(url=url, etag=etag, lastmodified=lastmodified, expires=expires, size=len(data))
+        with self.lock:
+            if not os.path.isdir(self.path):
+                os.makedirs(self.path)
+            try:
+                prevsize = os.path.getsize(base + ".data")
+            except OSError:
+                prevsize = 0
+            # cache content can always be fetched again, skip fsync
+            atomicWrite(base + ".data", data, DURABILITY_NONE)
+            atomicWrite(base + ".meta", json.dumps(meta).encode('utf-8'), DURABILITY_NONE)
+            if self.size is not None:
+                self.size += len(data) - prevsize
+            self._evict()
+
+    def putMeta(self, url, meta):
+        base = self._entryPath(url)
+        with self.lock:
+            if not os.path.exists(base + ".data"):
+                return
+            atomicWrite(base + ".meta", json.dumps(meta).encode('utf-8'), DURABILITY_NONE)
+
+    def _evict(self):
+        if self.size is None:
+            self.size = sum(size for mtime, size, name in self._entries())
+
+        if self.size <= self.maxsize:
+            return
+
+        for mtime, size, name in sorted(self._entries()):
+            if self.size <= self.maxsize:
+                break
+            self.log.info("evict: %s", name)
+            for ext in (".data", ".meta"):
+                try:
+                    os.unlink(os.path.join(self.path, name + ext))
+                except OSError:
+                    pass
+            self.size -= size
+
+    def fetch(self, url):
+        data, meta = self.get(url)
+        if data is not None and (meta.get('expires') or 0) > time.time():
+            return data
+
+        headers = dict()
+        if meta:
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('lastmodified'):
+                headers['If-Modified-Since'] = meta['lastmodified']
+
+        try:
+            ret = requests.get(url, headers=headers, timeout=self.timeout)
+        except Exception as e:
+            self.log.error("fetch(): %s: %s: %s", url, e.__class__.__name__, e)
+            # stale is better than nothing
+            return data
+
+        if ret.status_code == 304 and data is not None:
+            self.log.info("fetch(): not modified: %s", url)
+            meta['expires'] = freshUntil(ret.headers, time.time(), self.freshness)
+            if ret.headers.get('ETag'):
+                meta['etag'] = ret.headers['ETag']
+            try:
+                self.putMeta(url, meta)
+            except Exception as e:
+                self.log.error("fetch(): failed to store: %s: %s: %s", url, e.__class__.__name__, e)
+            return data
+
+        if ret.status_code != 200:
+            self.log.error("fetch(): %s: HTTP %s", url, ret.status_code)
+            return data
+
+        try:
+            self.put(url, ret.content, ret.headers.get('ETag'), ret.headers.get('Last-Modified'),
+                     freshUntil(ret.headers, time.time(), self.freshness))
+        except Exception as e:
+            self.log.error("fetch(): failed to store: %s: %s: %s", url, e.__class__.__name__, e)
+        return ret.content
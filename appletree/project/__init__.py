@@ -29,6 +29,7 @@ from configparser import ConfigParser
 from appletree.config import config
 from appletree.backend import loadBackend
 from appletree.helpers import genuid
+from appletree.project.doctree import DocTree
 import traceback
 
 META_KEYS = ('name', 'backend', 'sync')
@@ -52,6 +53,18 @@ class Project(object):
         else:
             self.path = os.path.join(config.data_dir, "projects", projectid)
 
+        self.doctree = None
+        self.doctreeserial = None
+
+    def docTree(self):
+        """ DocTree of documents, cached until backend doctree changes (backend treeserial) """
+        serial = self.doc.treeserial
+        if self.doctree is not None and serial is not None and serial == self.doctreeserial:
+            return self.doctree
+        self.doctree = DocTree.fromList(self.doc.getDocumentsTree())
+        self.doctreeserial = serial
+        return self.doctree
+
     def open(self):  # ???
         return True
 
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+#
+#       Copyright 2017+ Jakub Kolasa <jkolczasty@gmail.com>
+#
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 3 of the License, or
+#       (at your option) any later version.
+#
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+#
+# __author__ = 'Jakub Kolasa <jkolczasty@gmail.com'>
+#
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+import sys
+from array import array
+from appletree.helpers import walkDocumentsTree
+
+
+class DocTree(object):
+    """ Read-only documents tree in pre-order: node i is followed by its whole subtree (size[i] nodes,
+    including itself), parent/firstchild/nextsibling are node indexes (-1: none).
+    Serialised as the doctree JSON: [[docid, name, [children...]], ...] """
+
+    def __init__(self):
+        self.ids = []
+        self.names = []
+        self.parent = array('l')
+        self.firstchild = array('l')
+        self.nextsibling = array('l')
+        self.size = array('l')
+        self.depth = array('l')
+        # docid -> node index
+        self.index = dict()
+
+    @classmethod
+    def fromList(cls, doctree):
+        self = cls()
+        ids = self.ids
+        index = self.index
+        for docid, docname, parent, depth in walkDocumentsTree(doctree or ()):
+            index[docid] = len(ids)
+            ids.append(sys.intern(docid))
+            self.names.append(docname)
+            self.parent.append(-1 if parent is None else index[parent])
+            self.depth.append(depth)
+
+        count = len(ids)
+        self.size = array('l', [1]) * count
+        self.firstchild = array('l', [-1]) * count
+        self.nextsibling = array('l', [-1]) * count
+        parents = self.parent
+        sizes = self.size
+        for i in range(count - 1, -1, -1):
+            p = parents[i]
+            if p >= 0:
+                sizes[p] += sizes[i]
+        for i in range(count):
+            if sizes[i] > 1:
+                self.firstchild[i] = i + 1
+            n = i + sizes[i]
+            if n < count and parents[n] == parents[i]:
+                self.nextsibling[i] = n
+        return self
+
+    def toList(self, docid=None):
+        """ nested lists of the whole tree, or of docid subtree (docid included) """
+        if docid is None:
+            start, end = 0, len(self.ids)
+        else:
+            start = self.index[docid]
+            end = start + self.size[start]
+
+        ret = []
+        ids = self.ids
+        names = self.names
+        parents = self.parent
+        # (node index - start) -> children list
+        lists = [None] * (end - start)
+        for i in range(start, end):
+            children = lists[i - start] = []
+            p = parents[i] - start
+            (lists[p] if i != start and p >= 0 else ret).append([ids[i], names[i], children])
+        return ret
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, docid):
+        return docid in self.index
+
+    def name(self, docid):
+        return self.names[self.index[docid]]
+
+    def parentOf(self, docid):
+        p = self.parent[self.index[docid]]
+        return self.ids[p] if p >= 0 else None
+
+    def children(self, docid=None):
+        i = 0 if docid is None else self.firstchild[self.index[docid]]
+        if i >= len(self.ids):
+            return []
+        ret = []
+        while i >= 0:
+            ret.append(self.ids[i])
+            i = self.nextsibling[i]
+        return ret
+
+    def ancestors(self, docid):
+        ret = []
+        p = self.parent[self.index[docid]]
+        while p >= 0:
+            ret.append(self.ids[p])
+            p = self.parent[p]
+        return ret
+
+    def subtreeSize(self, docid):
+        return self.size[self.index[docid]]
+
+    def subtree(self, docid):
+        """ docids of docid subtree in pre-order (docid first) """
+        i = self.index[docid]
+        return self.ids[i:i + self.size[i]]
+
+    def walk(self, order='pre', docid=None):
+        """ like helpers.walkDocumentsTree(): yields (docid, name, parent, depth) """
+        if order not in ('pre', 'post'):
+            raise ValueError("order: " + str(order))
+        if docid is None:
+            start, end = 0, len(self.ids)
+        else:
+            start = self.index[docid]
+            end = start + self.size[start]
+
+        ids = self.ids
+        names = self.names
+        parents = self.parent
+        depths = self.depth
+
+        def node(i):
+            p = parents[i]
+            return ids[i], names[i], ids[p] if p >= 0 else None, depths[i]
+
+        if order == 'pre':
+            for i in range(start, end):
+                yield node(i)
+            return
+
+        stack = []
+        for i in range(start, end):
+            p = parents[i]
+            while stack and stack[-1] != p:
+                yield node(stack.pop())
+            stack.append(i)
+        while stack:
+            yield node(stack.pop())
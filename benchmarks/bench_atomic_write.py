@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+#
+#       Copyright 2017+ Jakub Kolasa <jkolczasty@gmail.com>
+#
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 3 of the License, or
+#       (at your option) any later version.
+#
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+#
+# __author__ = 'Jakub Kolasa <jkolczasty@gmail.com'>
+#
+
+# Throughput of atomicWrite() per durability policy, compared with plain in-place write.
+# Run from the repository root: python3 benchmarks/bench_atomic_write.py [--dir PATH] [--count N] [--size BYTES]
+# Use --dir on the same filesystem as your data folder, fsync cost depends heavily on it.
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from appletree.backend.base import atomicWrite, DURABILITY_POLICIES
+
+
+def writeInPlace(path, data, durability=None):
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def bench(name, func, folder, count, data, durability=None):
+    start = time.perf_counter()
+    for i in range(count):
+        func(os.path.join(folder, "document.{0}.atdoc".format(i % 16)), data, durability)
+    elapsed = time.perf_counter() - start
+    mb = len(data) * count / 1048576.0
+    print("{0:<12} {1:>10.0f} writes/s {2:>10.2f} MB/s {3:>10.3f} ms/write".format(
+        name, count / elapsed, mb / elapsed, elapsed * 1000.0 / count))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="atomicWrite() durability policies benchmark")
+    parser.add_argument("--dir", default=None, help="folder to write to (default: temp folder)")
+    parser.add_argument("--count", type=int, default=500)
+    parser.add_argument("--size", type=int, default=64 * 1024)
+    args = parser.parse_args()
+
+    data = os.urandom(args.size)
+    with tempfile.TemporaryDirectory(dir=args.dir) as folder:
+        print("folder: {0}, writes: {1}, size: {2} bytes".format(folder, args.count, args.size))
+        bench("in-place", writeInPlace, folder, args.count, data)
+        for policy in DURABILITY_POLICIES:
+            bench(policy, atomicWrite, folder, args.count, data, policy)
+
+
+if __name__ == "__main__":
+    main()
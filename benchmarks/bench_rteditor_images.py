@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+#
+#       Copyright 2017+ Jakub Kolasa <jkolczasty@gmail.com>
+#
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 3 of the License, or
+#       (at your option) any later version.
+#
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+#
+# __author__ = 'Jakub Kolasa <jkolczasty@gmail.com'>
+#
+
+# Images list of a rich text document on save: full document walk compared with images tracked on contents
+# changes, and the cost of tracking per typed character.
+# Run from the repository root: python3 benchmarks/bench_rteditor_images.py [--paragraphs N] [--images N]
+# Set QT_QPA_PLATFORM=offscreen to run without display.
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+
+def document(paragraphs, images):
+    from appletree.gui.qt import Qt
+    from appletree.gui.rteditorbase import RTDocument
+
+    doc = RTDocument(None, "bench")
+    image = Qt.QImage(16, 16, Qt.QImage.Format_ARGB32)
+    image.fill(0)
+    every = max(1, paragraphs // images) if images else 0
+    parts = []
+    for i in range(paragraphs):
+        img = ""
+        if every and i % every == 0:
+            name = "mem://{0}".format(i)
+            doc.addResource(Qt.QTextDocument.ImageResource, Qt.QUrl(name), image)
+            img = "<img src='{0}'/>".format(name)
+        parts.append("<p>Lorem <b>ipsum</b> dolor sit amet {0}, consectetur adipiscing elit.</p>".format(img))
+    doc.setHtml("<html><body>" + "".join(parts) + "</body></html>")
+    return doc
+
+
+def timeit(func, count):
+    start = time.perf_counter()
+    for i in range(count):
+        func()
+    return (time.perf_counter() - start) * 1000.0 / count
+
+
+def typing(doc, count):
+    from appletree.gui.qt import Qt
+    rnd = random.Random(0)
+    cursor = Qt.QTextCursor(doc)
+    start = time.perf_counter()
+    for i in range(count):
+        cursor.setPosition(rnd.randrange(doc.characterCount() - 1))
+        cursor.insertText("x")
+    return (time.perf_counter() - start) * 1000.0 / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="rich text document images tracking benchmark")
+    parser.add_argument("--paragraphs", type=int, default=20000)
+    parser.add_argument("--images", type=int, default=200)
+    parser.add_argument("--keys", type=int, default=2000)
+    args = parser.parse_args()
+
+    from appletree.gui.qt import initQtApplication
+    app = initQtApplication()
+
+    doc = document(args.paragraphs, args.images)
+    print("document: {0} characters, {1} images".format(doc.characterCount(), len(doc.imagenames)))
+    print("{0:<24} {1:>10.3f} ms".format("full walk", timeit(lambda: doc.scanImages(0, doc.characterCount()), 10)))
+    print("{0:<24} {1:>10.3f} ms".format("tracked", timeit(lambda: list(doc.imagenames), 100)))
+
+    tracked = typing(doc, args.keys)
+    doc.contentsChange.disconnect(doc.on_contents_change)
+    untracked = typing(doc, args.keys)
+    print("{0:<24} {1:>10.3f} ms".format("keystroke, tracking", tracked))
+    print("{0:<24} {1:>10.3f} ms".format("keystroke, no tracking", untracked))
+    del app
+
+
+if __name__ == "__main__":
+    main()
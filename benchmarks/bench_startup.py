@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+#
+#       Copyright 2017+ Jakub Kolasa <jkolczasty@gmail.com>
+#
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 3 of the License, or
+#       (at your option) any later version.
+#
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+#
+# __author__ = 'Jakub Kolasa <jkolczasty@gmail.com'>
+#
+
+
+# Cold start with restored document tabs: main window construction, load() and show() until the first paint,
+# eager (editor for every tab) vs lazy (placeholders, editor for the shown tab only).
+# Run from the repository root: python3 benchmarks/bench_startup.py [--tabs 50] [--size 200]
+# Every case runs in a fresh process on a temporary data dir, set QT_QPA_PLATFORM=offscreen to run without display.
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+BASE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, BASE_DIR)
+
+
+def rss():
+    # current resident memory in MB (linux), peak as fallback
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1048576.0
+    except Exception:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def setup(datadir, tabs, size):
+    # project with tabs documents of ~size KB of formatted html, all opened
+    from configparser import ConfigParser
+    from appletree.config import config
+    from appletree.project import Projects
+    from appletree.backend import loadBackend, registerBackend
+
+    registerBackend("local")
+    projectid = Projects().create("bench", "local", None)
+    backend = loadBackend("local", projectid)
+    paragraph = "<p>Lorem <b>ipsum</b> dolor <i>sit</i> amet, <span style='color:#a00'>consectetur</span> " \
+                "adipiscing elit, sed do eiusmod tempor incididunt ut labore et dolore magna aliqua.</p>\n"
+    body = "<html><body>" + paragraph * (size * 1024 // len(paragraph)) + "</body></html>"
+    tree = []
+    for i in range(tabs):
+        docid = "doc{0:03d}".format(i)
+        backend.putDocumentMeta(docid, dict(type="richtext"))
+        backend.putDocumentBody(docid, body)
+        tree.append([docid, "Document {0}".format(i), []])
+    backend.setDocumentsTree(tree)
+
+    cfg = ConfigParser()
+    section = "project:" + projectid
+    cfg.add_section(section)
+    cfg.set(section, "active", "1")
+    cfg.set(section, "openeddocuments", ",".join(docid for docid, name, children in tree))
+    cfg.set(section, "activedocument", tree[-1][0])
+    cfg.add_section("appletree")
+    cfg.set("appletree", "activeproject", projectid)
+    with open(os.path.join(config.config_dir, "appletree.conf"), "w") as f:
+        cfg.write(f)
+
+
+def run(mode, tabs, size):
+    os.chdir(BASE_DIR)
+    datadir = tempfile.mkdtemp(prefix="atbench.")
+    try:
+        from appletree.config import config
+        config.base_dir = BASE_DIR
+        config.data_dir = datadir
+        config.config_dir = os.path.join(datadir, "config")
+        config.cache_dir = os.path.join(datadir, "cache")
+        os.makedirs(config.config_dir)
+        os.makedirs(os.path.join(datadir, "projects"))
+        config.tabs_lazy_restore = mode == "lazy"
+
+        from appletree.gui.qt import Qt, QtCore, initQtApplication
+        app = initQtApplication()
+        setup(datadir, tabs, size)
+
+        from appletree.gui.mw import AppleTreeMainWindow
+
+        class PaintWatch(Qt.QObject):
+            # first paint of the main window (progress dialog paints during load too)
+            win = None
+            painted = None
+
+            def eventFilter(self, obj, event):
+                if self.painted is None and self.win is not None and event.type() == QtCore.QEvent.Paint and \
+                        isinstance(obj, Qt.QWidget) and obj.window() is self.win:
+                    self.painted = time.perf_counter()
+                return False
+
+        watch = PaintWatch()
+        app.installEventFilter(watch)
+
+        before = rss()
+        start = time.perf_counter()
+        win = AppleTreeMainWindow()
+        loaded = time.perf_counter()
+        watch.win = win
+        win.show()
+        while watch.painted is None and time.perf_counter() - start < 600:
+            app.processEvents()
+        # let lazy tab of the shown document get its editor
+        deadline = time.perf_counter() + 0.5
+        while time.perf_counter() < deadline:
+            app.processEvents()
+
+        projectv = list(win.projectsViews.values())[0]
+        print("{0:<6} {1:>3} tabs x {2:>4} KB  load {3:>7.3f} s  first paint {4:>7.3f} s  editors {5:>3}  "
+              "rss +{6:>7.1f} MB".format(mode, tabs, size, loaded - start, watch.painted - start,
+                                         len(projectv.editors), rss() - before))
+    finally:
+        shutil.rmtree(datadir, True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="startup with restored tabs benchmark")
+    parser.add_argument("--tabs", type=int, default=50)
+    parser.add_argument("--size", type=int, default=200, help="document size in KB")
+    parser.add_argument("--modes", default="eager,lazy")
+    parser.add_argument("--run", nargs=3, metavar=("MODE", "TABS", "SIZE"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        return run(args.run[0], int(args.run[1]), int(args.run[2]))
+
+    for mode in args.modes.split(","):
+        subprocess.call([sys.executable, os.path.abspath(__file__), "--run", mode, str(args.tabs), str(args.size)])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+#
+#       Copyright 2017+ Jakub Kolasa <jkolczasty@gmail.com>
+#
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 3 of the License, or
+#       (at your option) any later version.
+#
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+#
+# __author__ = 'Jakub Kolasa <jkolczasty@gmail.com'>
+#
+
+# Tree load time and resident memory with tagged nodes: TagsItemDelegate vs per-row QWidget/QLabel (old way).
+# Run from the repository root: python3 benchmarks/bench_tree_tags.py [--sizes 1000,10000,50000]
+# Widgets mode grows superlinearly, it is skipped above --widgets-max nodes.
+# Every case runs in a fresh process, set QT_QPA_PLATFORM=offscreen to run without display.
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+BASE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, BASE_DIR)
+
+
+def rss():
+    # current resident memory in MB (linux), peak as fallback
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1048576.0
+    except Exception:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def run(mode, count):
+    os.chdir(BASE_DIR)
+    from appletree.config import config
+    config.base_dir = BASE_DIR
+    from appletree.gui.qt import Qt, initQtApplication
+    from appletree.gui.consts import TREE_COLUMN_COUNT, TREE_COLUMN_NAME, TREE_COLUMN_UID, TREE_COLUMN_ICON, \
+        TREE_COLUMN_TAGS
+    from appletree.gui.treeview import TagsItemDelegate
+    from appletree.helpers import getTagPixmap
+
+    app = initQtApplication()
+    tree = Qt.QTreeWidget()
+    tree.setColumnCount(TREE_COLUMN_COUNT)
+    tree.setColumnHidden(TREE_COLUMN_UID, True)
+    tree.setColumnHidden(TREE_COLUMN_TAGS, True)
+    if mode == "delegate":
+        tree.setItemDelegateForColumn(TREE_COLUMN_ICON, TagsItemDelegate(tree))
+    tree.resize(600, 800)
+    tree.show()
+    app.processEvents()
+
+    before = rss()
+    start = time.perf_counter()
+    root = tree.invisibleRootItem()
+    tagsets = (["important"], ["highprio"], ["important", "highprio"])
+    for i in range(count):
+        tags = tagsets[i % len(tagsets)]
+        columns = [None] * TREE_COLUMN_COUNT
+        columns[TREE_COLUMN_NAME] = "Document {0}".format(i)
+        columns[TREE_COLUMN_UID] = str(i)
+        columns[TREE_COLUMN_TAGS] = ",".join(tags)
+        item = Qt.QTreeWidgetItem(root, columns)
+        if mode == "widgets":
+            icons = Qt.QWidget(tree)
+            layout = Qt.QHBoxLayout()
+            icons.setLayout(layout)
+            layout.setContentsMargins(1, 1, 1, 1)
+            layout.insertStretch(-1, 100)
+            for tag in tags:
+                label = Qt.QLabel()
+                label.setPixmap(getTagPixmap(tag, 16))
+                layout.addWidget(label)
+            tree.setItemWidget(item, TREE_COLUMN_ICON, icons)
+    tree.resizeColumnToContents(TREE_COLUMN_ICON)
+    app.processEvents()
+    elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    bar = tree.verticalScrollBar()
+    for value in range(0, bar.maximum(), max(1, bar.maximum() // 50)):
+        bar.setValue(value)
+        tree.repaint()
+    scroll = time.perf_counter() - start
+
+    print("{0:<10} {1:>7} nodes  load {2:>8.3f} s  scroll(50 pages) {3:>7.3f} s  rss +{4:>8.1f} MB".format(
+        mode, count, elapsed, scroll, rss() - before))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="tags column painting benchmark")
+    parser.add_argument("--sizes", default="1000,10000,50000")
+    parser.add_argument("--modes", default="delegate,widgets")
+    parser.add_argument("--widgets-max", type=int, default=10000, help="largest size measured in widgets mode")
+    parser.add_argument("--run", nargs=2, metavar=("MODE", "COUNT"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        return run(args.run[0], int(args.run[1]))
+
+    for count in args.sizes.split(","):
+        for mode in args.modes.split(","):
+            if mode == "widgets" and int(count) > args.widgets_max:
+                print("{0:<10} {1:>7} nodes  skipped (--widgets-max {2})".format(mode, count, args.widgets_max))
+                continue
+            subprocess.call([sys.executable, os.path.abspath(__file__), "--run", mode, count])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+#
+#       Copyright 2017+ Jakub Kolasa <jkolczasty@gmail.com>
+#
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 3 of the License, or
+#       (at your option) any later version.
+#
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+#
+# __author__ = 'Jakub Kolasa <jkolczasty@gmail.com'>
+#
+
+# Documents tree traversal over synthetic doctrees: recursive callbacks (old helpers) vs walkDocumentsTree().
+# Run from the repository root: python3 benchmarks/bench_tree_traversal.py [--nodes 1000000]
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from appletree.helpers import walkDocumentsTree
+
+
+def buildTree(nodes, fanout):
+    # breadth first, every node gets up to fanout children
+    root = []
+    queue = [root]
+    count = 0
+    while count < nodes:
+        items = queue.pop(0)
+        for i in range(fanout):
+            if count >= nodes:
+                break
+            children = []
+            items.append(["doc{0}".format(count), "Document {0}".format(count), children])
+            queue.append(children)
+            count += 1
+    return root
+
+
+def buildChain(nodes):
+    root = []
+    items = root
+    for count in range(nodes):
+        children = []
+        items.append(["doc{0}".format(count), "Document {0}".format(count), children])
+        items = children
+    return root
+
+
+def _recursive(docid, docname, items, parent, callback):
+    callback(docid, docname, parent)
+    for childdocid, childdocname, childitems in items:
+        _recursive(childdocid, childdocname, childitems, docid, callback)
+
+
+def recursive(doctree):
+    count = [0]
+
+    def callback(docid, docname, parent):
+        count[0] += 1
+
+    for docid, docname, items in doctree:
+        _recursive(docid, docname, items, None, callback)
+    return count[0]
+
+
+def walk(doctree, order):
+    count = 0
+    for node in walkDocumentsTree(doctree, order):
+        count += 1
+    return count
+
+
+def measure(name, func, *args):
+    start = time.perf_counter()
+    try:
+        count = func(*args)
+    except RecursionError:
+        print("{0:<28} RecursionError".format(name))
+        return
+    print("{0:<28} {1:>8} nodes {2:>8.3f} s".format(name, count, time.perf_counter() - start))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="documents tree traversal benchmark")
+    parser.add_argument("--nodes", type=int, default=1000000)
+    args = parser.parse_args()
+
+    for title, doctree in (("fanout 10", buildTree(args.nodes, 10)),
+                           ("fanout 1000", buildTree(args.nodes, 1000)),
+                           ("chain", buildChain(args.nodes))):
+        print("{0}, {1} nodes (recursion limit {2})".format(title, args.nodes, sys.getrecursionlimit()))
+        measure("  recursive callbacks", recursive, doctree)
+        measure("  walkDocumentsTree pre", walk, doctree, 'pre')
+        measure("  walkDocumentsTree post", walk, doctree, 'post')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+#
+#       Copyright 2017+ Jakub Kolasa <jkolczasty@gmail.com>
+#
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 3 of the License, or
+#       (at your option) any later version.
+#
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+#
+# __author__ = 'Jakub Kolasa <jkolczasty@gmail.com'>
+#
+
+# Project archives: export, import and old (baseline) archives.
+
+import os
+import json
+import shutil
+import tempfile
+import time
+import unittest
+import zipfile
+
+from appletree.config import config
+from appletree.archive import AppleTreeArchive
+from appletree.backend import registerBackend
+from appletree.project import Projects
+from appletree.gui.qt import Qt
+
+
+class ArchiveTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.datadir = config.data_dir
+        config.data_dir = os.path.join(self.tmp, "data")
+        os.makedirs(os.path.join(config.data_dir, "projects"))
+        registerBackend("local")
+        self.projects = Projects()
+
+    def tearDown(self):
+        config.data_dir = self.datadir
+        shutil.rmtree(self.tmp)
+
+    def project(self, name):
+        return self.projects.open(self.projects.create(name, 'local', None))
+
+    def export(self, project, filename, base=None):
+        arch = AppleTreeArchive(filename)
+        self.assertTrue(arch.create())
+        if base:
+            arch.setBase(base)
+        doctree = project.docTree()
+        self.assertTrue(arch.exportProject(project, doctree, project.doc.getDocumentsMetaBulk(doctree.ids)))
+        self.assertTrue(arch.close())
+
+    def restore(self, filename, projectid):
+        arch = AppleTreeArchive(filename)
+        self.assertTrue(arch.open())
+        try:
+            doc = self.project("Restored").doc
+            self.assertTrue(arch.importProject(projectid, doc))
+        finally:
+            arch.close()
+        return doc
+
+    def documents(self, doc):
+        """ docid -> (type, body) of all documents in doc tree """
+        ret = dict()
+        stack = list(doc.getDocumentsTree() or ())
+        while stack:
+            docid, name, children = stack.pop()
+            ret[docid] = ((doc.getDocumentMeta(docid) or {}).get('type'), doc.getDocumentBody(docid))
+            stack.extend(children)
+        return ret
+
+    def test_import_without_doctree(self):
+        # written like the exporter before doctree and manifest were archived
+        filename = os.path.join(self.tmp, "old.atarch")
+        with zipfile.ZipFile(filename, 'w', compression=zipfile.ZIP_BZIP2) as a:
+            for docid in ("d1", "d2"):
+                path = os.path.join('projects', 'p1', 'documents', docid)
+                a.writestr(os.path.join(path, 'document.meta.atdoc'), json.dumps({"type": "richtext"}))
+                a.writestr(os.path.join(path, 'document.atdoc'), "<p>body of {0}</p>".format(docid))
+            a.writestr('appletree.archive', json.dumps(dict(projects={"p1": "Old"}, timestamp=time.time())))
+
+        arch = AppleTreeArchive(filename)
+        self.assertTrue(arch.open())
+        try:
+            doc = self.project("Imported").doc
+            self.assertTrue(arch.importProject("p1", doc))
+        finally:
+            arch.close()
+
+        self.assertEqual([item[0] for item in doc.getDocumentsTree()], ["d1", "d2"])
+        self.assertEqual(self.documents(doc), {
+            "d1": ("richtext", "<p>body of d1</p>"),
+            "d2": ("richtext", "<p>body of d2</p>"),
+        })
+
+
+    def test_differential_chain(self):
+        project = self.project("Notes")
+        doc = project.doc
+        for docid in ("d1", "d2", "d3"):
+            doc.putDocumentMeta(docid, {"type": "richtext"})
+            doc.putDocumentBody(docid, "<p>{0}</p>".format(docid) * 100)
+        image = Qt.QImage(8, 8, Qt.QImage.Format_ARGB32)
+        image.fill(0xff0000ff)
+        imagename = doc.putImage("d1", "image1", image)
+        doc.setDocumentsTree([["d1", "D1", [["d2", "D2", []]]], ["d3", "D3", []]])
+        full = os.path.join(self.tmp, "full.atarch")
+        self.export(project, full)
+
+        doc.putDocumentBody("d2", "<p>changed</p>")
+        doc.putDocumentMeta("d4", {"type": "plaintext"})
+        doc.putDocumentBody("d4", "added")
+        doc.removeDocument("d3")
+        tree = [["d1", "D1", [["d2", "D2", []]]], ["d4", "D4", []]]
+        doc.setDocumentsTree(tree)
+        expected = self.documents(doc)
+        imagedata = doc.getImageRaw("d1", imagename)
+        self.assertTrue(imagedata)
+
+        base = AppleTreeArchive(full)
+        self.assertTrue(base.open())
+        diff = os.path.join(self.tmp, "diff.atarch")
+        try:
+            self.export(project, diff, base)
+        finally:
+            base.close()
+
+        prefix = AppleTreeArchive.documentPath(project.projectid)
+        with zipfile.ZipFile(diff) as a:
+            stored = set(name[len(prefix):] for name in a.namelist() if name.startswith(prefix))
+        # unchanged documents and files come from the base archive
+        self.assertEqual(stored, {"applenote.doctree", "d2/document.atdoc", "d4/document.meta.atdoc",
+                                  "d4/document.atdoc"})
+
+        restored = self.restore(diff, project.projectid)
+        self.assertEqual(restored.getDocumentsTree(), tree)
+        self.assertEqual(self.documents(restored), expected)
+        self.assertIsNone(restored.getDocumentBody("d3"))
+        self.assertEqual(restored.getImageRaw("d1", imagename), imagedata)
+
+        # merged chain is a full archive on its own
+        arch = AppleTreeArchive(diff)
+        self.assertTrue(arch.open())
+        merged = os.path.join(self.tmp, "merged.atarch")
+        try:
+            self.assertTrue(arch.merge(merged))
+        finally:
+            arch.close()
+        os.remove(full)
+        os.remove(diff)
+
+        restored = self.restore(merged, project.projectid)
+        self.assertEqual(restored.getDocumentsTree(), tree)
+        self.assertEqual(self.documents(restored), expected)
+        self.assertEqual(restored.getImageRaw("d1", imagename), imagedata)
+
+
+if __name__ == "__main__":
+    unittest.main()
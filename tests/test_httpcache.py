@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+#
+#       Copyright 2017+ Jakub Kolasa <jkolczasty@gmail.com>
+#
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 3 of the License, or
+#       (at your option) any later version.
+#
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+#
+# __author__ = 'Jakub Kolasa <jkolczasty@gmail.com'>
+#
+
+# HttpCache against a local stand-in HTTP server.
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+from appletree.httpcache import HttpCache
+
+LAST_MODIFIED = "Mon, 01 Jan 2024 00:00:00 GMT"
+
+
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        server.requests.append((self.path, dict(self.headers)))
+        body = server.bodies.get(self.path)
+        if body is None:
+            self.send_response(404)
+            self.end_headers()
+            return
+
+        etag = '"{0}"'.format(self.path.strip("/"))
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', LAST_MODIFIED)
+        if server.cachecontrol:
+            self.send_header('Cache-Control', server.cachecontrol)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class HttpCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.server = HTTPServer(("127.0.0.1", 0), Handler)
+        self.server.requests = []
+        self.server.bodies = dict()
+        self.server.cachecontrol = None
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmp)
+
+    def url(self, path):
+        return "http://127.0.0.1:{0}{1}".format(self.server.server_address[1], path)
+
+    def cache(self, maxsize=1024 * 1024, freshness=0):
+        return HttpCache(os.path.join(self.tmp, "http"), maxsize, timeout=5, freshness=freshness)
+
+    def test_store_and_revalidate(self):
+        self.server.bodies["/a.png"] = b"image-a"
+        cache = self.cache()
+
+        self.assertEqual(cache.fetch(self.url("/a.png")), b"image-a")
+        data, meta = cache.get(self.url("/a.png"))
+        self.assertEqual(data, b"image-a")
+        self.assertEqual(meta['etag'], '"a.png"')
+        self.assertEqual(meta['lastmodified'], LAST_MODIFIED)
+
+        # changed on server, but 304 says cached copy is still valid
+        self.server.bodies["/a.png"] = b"changed"
+        self.assertEqual(cache.fetch(self.url("/a.png")), b"image-a")
+        self.assertEqual(len(self.server.requests), 2)
+        headers = self.server.requests[-1][1]
+        self.assertEqual(headers.get('If-None-Match'), '"a.png"')
+        self.assertEqual(headers.get('If-Modified-Since'), LAST_MODIFIED)
+
+    def test_fresh_without_request(self):
+        self.server.bodies["/a.png"] = b"image-a"
+        self.server.bodies["/b.png"] = b"image-b"
+
+        self.server.cachecontrol = "max-age=60"
+        cache = self.cache()
+        cache.fetch(self.url("/a.png"))
+        self.assertEqual(cache.fetch(self.url("/a.png")), b"image-a")
+        self.assertEqual(len(self.server.requests), 1)
+
+        # no-cache wins over default freshness
+        self.server.cachecontrol = "no-cache"
+        cache = self.cache(freshness=60)
+        cache.fetch(self.url("/b.png"))
+        cache.fetch(self.url("/b.png"))
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_lru_eviction(self):
+        for name in ("a", "b", "c"):
+            self.server.bodies["/" + name] = name.encode('utf-8') * 400
+        cache = self.cache(maxsize=1000)
+
+        cache.fetch(self.url("/a"))
+        cache.fetch(self.url("/b"))
+        # a used more recently than b
+        cache.get(self.url("/a"))
+        cache.fetch(self.url("/c"))
+
+        self.assertIsNotNone(cache.get(self.url("/a"))[0])
+        self.assertIsNone(cache.get(self.url("/b"))[0])
+        self.assertIsNotNone(cache.get(self.url("/c"))[0])
+        self.assertLessEqual(sum(os.path.getsize(os.path.join(self.tmp, "http", fn))
+                                 for fn in os.listdir(os.path.join(self.tmp, "http")) if fn.endswith(".data")), 1000)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+#
+#       Copyright 2017+ Jakub Kolasa <jkolczasty@gmail.com>
+#
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 3 of the License, or
+#       (at your option) any later version.
+#
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+#
+# __author__ = 'Jakub Kolasa <jkolczasty@gmail.com'>
+#
+
+# Doctree journal crash recovery: every load must end on the state of the last completed save.
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+from appletree.config import config
+from appletree.backend.base import atomicWrite
+from appletree.backend.journal import DocTreeJournal
+
+TREE_A = [["a", "A", [["a1", "A1", []]]], ["b", "B", []]]
+TREE_B = [["b", "B", [["a", "A", [["a1", "A1", []]]]]], ["c", "C", []]]
+TREE_C = [["c", "C2", []], ["b", "B", [["a", "A", []]]]]
+
+
+class DocTreeJournalTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, "applenote.doctree")
+        self.saved = dict((key, config[key]) for key in ('durability', 'doctree_journal_ops', 'doctree_journal_size'))
+        config.durability = 'none'
+        config.doctree_journal_ops = 1000
+        config.doctree_journal_size = 1024 * 1024
+
+    def tearDown(self):
+        for key, value in self.saved.items():
+            config[key] = value
+        shutil.rmtree(self.tmp)
+
+    def journal(self, *trees):
+        journal = DocTreeJournal(self.path)
+        journal.load()
+        for tree in trees:
+            journal.save(tree)
+        return journal
+
+    def reload(self):
+        return DocTreeJournal(self.path).load()
+
+    def test_replay(self):
+        journal = self.journal(TREE_A, TREE_B, TREE_C)
+        self.assertEqual(journal.ops, 6)
+        self.assertEqual(self.reload(), TREE_C)
+
+    def test_torn_last_line(self):
+        self.journal(TREE_A, TREE_B)
+        # save of TREE_C interrupted in the middle of its line
+        line = json.dumps([["rename", "c", "C2"], ["move", "c", None, None]])
+        with open(self.path + ".journal", "ab") as f:
+            f.write(line[:len(line) // 2].encode('utf-8'))
+
+        journal = DocTreeJournal(self.path)
+        self.assertEqual(journal.load(), TREE_B)
+        # torn entry is gone, next saves are not appended after it
+        journal.save(TREE_C)
+        self.assertEqual(self.reload(), TREE_C)
+
+    def test_stale_journal(self):
+        self.journal(TREE_A, TREE_B)
+        # compaction of TREE_C interrupted: new snapshot written, journal still of the old snapshot
+        atomicWrite(self.path, json.dumps(TREE_C).encode('utf-8'))
+
+        journal = DocTreeJournal(self.path)
+        self.assertEqual(journal.load(), TREE_C)
+        self.assertEqual(journal.ops, 0)
+        journal.save(TREE_A)
+        self.assertEqual(self.reload(), TREE_A)
+
+    def test_compaction_by_ops(self):
+        config.doctree_journal_ops = 4
+        journal = self.journal(TREE_A, TREE_B)
+        snapshot = journal.snapshot
+        # TREE_C operations do not fit into the journal anymore
+        journal.save(TREE_C)
+        self.assertNotEqual(journal.snapshot, snapshot)
+        self.assertEqual(journal.ops, 0)
+        with open(self.path, "rb") as f:
+            self.assertEqual(json.loads(f.read().decode('utf-8')), TREE_C)
+        self.assertEqual(self.reload(), TREE_C)
+
+    def test_compaction_by_size(self):
+        journal = self.journal(TREE_A)
+        config.doctree_journal_size = journal.size + 10
+        snapshot = journal.snapshot
+        journal.save(TREE_B)
+        self.assertNotEqual(journal.snapshot, snapshot)
+        with open(self.path + ".journal", "rb") as f:
+            # header only
+            self.assertEqual(len(f.read().split(b"\n")), 2)
+        self.assertEqual(self.reload(), TREE_B)
+        journal.save(TREE_C)
+        self.assertEqual(self.reload(), TREE_C)
+
+
+if __name__ == "__main__":
+    unittest.main()